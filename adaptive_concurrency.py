@@ -0,0 +1,237 @@
+# adaptive_concurrency.py
+"""
+mhlw.go.jp への同時リクエスト数を自動調整する AIMD (加算増加・乗算減少) コントローラー。
+
+- 応答は1ウィンドウ (=現在の上限分、最低 MIN_WINDOW_SAMPLES 件) ごとにまとめ、その中央値で判定する
+- レイテンシとエラー率が健全な間は、同時実行数の上限を1ウィンドウごとに +1 する
+- 429 / 5xx / タイムアウト、またはウィンドウの中央値が基準値の LATENCY_TOLERANCE 倍を超えたら
+  上限に BACKOFF_FACTOR を掛ける
+- 基準値は、基準値に近い (BASELINE_GATE 倍未満の) ウィンドウの中央値のEWMA。
+  個々の応答ではなく中央値を使うので、キャッシュされたページの速い応答や通常のばらつきを混雑と誤認せず、
+  上限を上げるにつれて少しずつ遅くなる混雑も基準値に取り込まない
+- Retry-After が返ってきたら、その時刻まで新しいリクエストを一切出さない
+- 上限が MIN_CONCURRENCY まで下がっている間は、リクエストの開始間隔を REQUEST_DELAY_SECONDS 以上あける
+- Retry-Afterのない429/5xx・接続エラーを再試行するときは retry_delay() の秒数 (指数バックオフ) だけ待つ
+
+discover_urls (スレッド) はワーカー内で slot() を使い、
+preprocess (プロセス) は親プロセスでジョブの投入前に acquire()、結果を受け取ったら release() する。
+"""
+import sys
+import time
+import random
+import statistics
+import threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+import metrics
+
+# バックオフの対象とするHTTPステータス (これ以外の4xxはサーバー負荷とは無関係として扱う)
+OVERLOAD_STATUSES = frozenset([429, 500, 502, 503, 504])
+# 1ウィンドウの最小サンプル数、基準レイテンシ(ウィンドウの中央値のEWMA)の平滑化係数と、
+# 基準値を更新するウィンドウの上限 (これより遅いウィンドウは混雑し始めている可能性があるため使わない)
+MIN_WINDOW_SAMPLES = 16
+BASELINE_ALPHA = 0.1
+BASELINE_GATE = 1.2
+
+
+def parse_retry_after(value, now: float = None):
+    """Retry-Afterヘッダー (秒数またはHTTP-date) を待ち秒数に変換する。解釈できなければNone"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    now = datetime.now(timezone.utc).timestamp() if now is None else now
+    return max(0.0, retry_at.timestamp() - now)
+
+
+class AdaptiveConcurrency:
+    """スレッドセーフなAIMDリミッター"""
+
+    def __init__(self, initial: int = 4, min_limit: int = 1, max_limit: int = 16,
+                 backoff_factor: float = 0.5, latency_tolerance: float = 2.0,
+                 max_retry_after: float = 120.0, min_interval: float = 0.0, name: str = "http",
+                 clock=time.monotonic):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.backoff_factor = backoff_factor
+        self.latency_tolerance = latency_tolerance
+        self.max_retry_after = max_retry_after
+        self.min_interval = max(0.0, min_interval)
+        self.name = name
+        self._clock = clock
+
+        self._cond = threading.Condition()
+        self._limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self._in_flight = 0
+        self._blocked_until = 0.0
+        self._last_start = None
+        self._last_decrease = 0.0
+        # 基準レイテンシと、集計中のウィンドウのサンプル
+        self._baseline = None
+        self._window = []
+        # 1往復の目安 (EWMA)。減少を1往復に1回にまとめるのに使う
+        self._rtt = None
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _not_before(self) -> float:
+        """次のリクエストを開始できる時刻 (Retry-Afterの待機と、下限時の最小間隔)"""
+        not_before = self._blocked_until
+        if self.min_interval and self._last_start is not None and int(self._limit) <= self.min_limit:
+            not_before = max(not_before, self._last_start + self.min_interval)
+        return not_before
+
+    def _available(self, now: float) -> bool:
+        return now >= self._not_before() and self._in_flight < int(self._limit)
+
+    def acquire(self, block: bool = True, timeout: float = None) -> bool:
+        """空きスロットを確保する。Retry-Afterの待機中や上限到達中はブロックする"""
+        start = self._clock()
+        deadline = None if timeout is None else start + timeout
+        with self._cond:
+            while True:
+                now = self._clock()
+                if self._available(now):
+                    self._in_flight += 1
+                    self._last_start = now
+                    break
+                if not block or (deadline is not None and now >= deadline):
+                    return False
+                wait = None if deadline is None else deadline - now
+                not_before = self._not_before()
+                if now < not_before:
+                    wait = not_before - now if wait is None else min(wait, not_before - now)
+                self._cond.wait(wait)
+        waited = self._clock() - start
+        if waited > 0.001:
+            metrics.observe(f"{self.name}.slot_wait_ms", waited * 1000.0)
+        return True
+
+    def release(self, latency: float = None, status_code: int = None, retry_after: float = None,
+                error: bool = False):
+        """
+        リクエストの結果を記録してスロットを返す。
+        latency は応答ヘッダーまでの秒数、error は接続エラー・タイムアウトのときTrue。
+        結果を記録せずに返す場合 (リクエストしなかった場合など) は引数を省略する。
+        """
+        with self._cond:
+            self._in_flight = max(0, self._in_flight - 1)
+            now = self._clock()
+            if retry_after is not None:
+                wait = min(max(retry_after, 0.0), self.max_retry_after)
+                self._blocked_until = max(self._blocked_until, now + wait)
+                metrics.incr(f"{self.name}.retry_after")
+                metrics.observe(f"{self.name}.retry_after_ms", wait * 1000.0)
+
+            if error or status_code in OVERLOAD_STATUSES:
+                reason = "error" if error else f"HTTP {status_code}"
+                self._decrease(now, reason)
+            elif latency is not None:
+                self._observe_latency(now, latency)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """with文で1リクエスト分のスロットを確保する。結果は yield されたオブジェクトの record() で渡す"""
+        self.acquire()
+        outcome = _Outcome()
+        try:
+            yield outcome
+        finally:
+            self.release(**outcome.kwargs)
+
+    def _observe_latency(self, now: float, latency: float):
+        self._rtt = latency if self._rtt is None else 0.8 * self._rtt + 0.2 * latency
+        self._window.append(latency)
+        if len(self._window) < max(MIN_WINDOW_SAMPLES, int(self._limit)):
+            return
+        # ウィンドウ1つ分の応答がそろったら、その中央値を基準値と比べる
+        recent = statistics.median(self._window)
+        self._window = []
+        baseline = recent if self._baseline is None else self._baseline
+        congested = recent > baseline * self.latency_tolerance
+        # 下限まで絞っても遅いなら、サーバー自体が遅くなったとみなして追従する
+        if recent < baseline * BASELINE_GATE or int(self._limit) <= self.min_limit:
+            self._baseline = baseline + BASELINE_ALPHA * (recent - baseline)
+        if congested:
+            self._decrease(now, f"latency {recent * 1000:.0f}ms (baseline {baseline * 1000:.0f}ms)")
+        else:
+            self._increase()
+
+    def _increase(self):
+        if self._limit < self.max_limit:
+            old = int(self._limit)
+            self._limit = min(self.max_limit, self._limit + 1.0)
+            if int(self._limit) > old:
+                metrics.incr(f"{self.name}.limit_increase")
+
+    def _decrease(self, now: float, reason: str):
+        # 同じ混雑に対する応答がまとめて返ってきても、1往復につき1回だけ減らす
+        window = self._rtt if self._rtt is not None else 1.0
+        if now - self._last_decrease < window:
+            return
+        self._last_decrease = now
+        old = int(self._limit)
+        self._limit = max(float(self.min_limit), self._limit * self.backoff_factor)
+        metrics.incr(f"{self.name}.limit_decrease")
+        if int(self._limit) != old:
+            print(f"  [~] Concurrency {old} -> {int(self._limit)} ({reason})", file=sys.stderr)
+
+
+def retry_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """
+    Retry-Afterのない失敗をattempt回目の試行のあとに再試行するまでの秒数。
+    base * 2^(attempt-1) を上限capで切り、同時に失敗したリクエストが揃って再送しないよう±50%ずらす。
+    """
+    if base <= 0:
+        return 0.0
+    return min(cap, base * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+
+
+class _Outcome:
+    __slots__ = ("kwargs",)
+
+    def __init__(self):
+        self.kwargs = {}
+
+    def record(self, latency: float = None, status_code: int = None, retry_after: float = None,
+               error: bool = False):
+        self.kwargs = {"latency": latency, "status_code": status_code, "retry_after": retry_after, "error": error}
+
+
+def controller_from_config(config, max_limit: int = None, name: str = "http"):
+    """
+    config.iniの[Concurrency]からコントローラーを作る。ADAPTIVE = false ならNoneを返す。
+    max_limit を渡すと MAX_CONCURRENCY との小さい方を上限にする (プロセス数の上限など)。
+    [General] REQUEST_DELAY_SECONDS は、上限が下限まで下がったときのリクエストの最小間隔として使う。
+    """
+    if not config.getboolean('Concurrency', 'ADAPTIVE', fallback=True):
+        return None
+    upper = config.getint('Concurrency', 'MAX_CONCURRENCY', fallback=16)
+    if max_limit is not None:
+        upper = min(upper, max_limit)
+    return AdaptiveConcurrency(
+        initial=config.getint('Concurrency', 'INITIAL_CONCURRENCY', fallback=4),
+        min_limit=config.getint('Concurrency', 'MIN_CONCURRENCY', fallback=1),
+        max_limit=upper,
+        backoff_factor=config.getfloat('Concurrency', 'BACKOFF_FACTOR', fallback=0.5),
+        latency_tolerance=config.getfloat('Concurrency', 'LATENCY_TOLERANCE', fallback=2.0),
+        max_retry_after=config.getfloat('Concurrency', 'MAX_RETRY_AFTER_SECONDS', fallback=120.0),
+        min_interval=config.getfloat('General', 'REQUEST_DELAY_SECONDS', fallback=0.0),
+        name=name,
+    )
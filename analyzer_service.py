@@ -0,0 +1,270 @@
+# analyzer_service.py
+"""
+解析モデルを一度だけロードして常駐し、Unixドメインソケット経由で文のバッチを解析するサービス。
+
+process_ginza.py / process_stanza.py は起動のたびにspaCyやStanzaを読み込み、モデルをロードし直す。
+短時間の実行を繰り返す場合はその時間が大半を占めるため、モデルをこのサービスに常駐させておき、
+run_analyzer() はソケット (<SOCKET_DIR>/<解析器名>.sock) が応答すればバッチをサービスに送る。
+応答しなければ従来どおり自分のプロセスでモデルをロードする。
+
+    python analyzer_service.py ginza          # GiNZAのサービスを起動 (Ctrl-C / SIGTERMで停止)
+    python analyzer_service.py stanza
+    python process_ginza.py                   # 起動中のサービスがあれば自動的に使う
+
+プロトコルは1行1JSONのリクエスト/レスポンス:
+    {"sentences": ["...", ...]}  ->  {"words": [...], "inference_ms": 12.3}
+    {"ping": true}               ->  {"analyzer": "ginza", "pid": 123, "model_load_ms": 4567.8, ...}
+    エラー時                      ->  {"error": "..."}
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import importlib
+import threading
+import configparser
+import socketserver
+
+import metrics
+from analyzers import ANALYZER_MODULES
+
+DEFAULT_SOCKET_DIR = ".analyzer_service"
+
+
+def socket_path(config, name: str) -> str:
+    """config.iniの[AnalyzerService] SOCKET_DIR にある解析器ごとのソケットのパス"""
+    socket_dir = config.get('AnalyzerService', 'SOCKET_DIR', fallback=DEFAULT_SOCKET_DIR) or DEFAULT_SOCKET_DIR
+    return os.path.join(socket_dir, f"{name}.sock")
+
+
+# --- Client ---
+class AnalyzerClient:
+    """サービスへの1本の接続。1つのプロセスから順番にリクエストを送る前提でスレッドセーフではない"""
+
+    def __init__(self, path: str, timeout: float = 600.0):
+        self.path = path
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+        self._reader = sock.makefile("rb")
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+        if self._sock is not None:
+            self._sock.close()
+        self._sock = self._reader = None
+
+    def request(self, payload: dict) -> dict:
+        if self._sock is None:
+            self._connect()
+        try:
+            self._sock.sendall(json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n")
+            line = self._reader.readline()
+        except OSError:
+            self.close()
+            raise
+        if not line:
+            self.close()
+            raise ConnectionError(f"Analyzer service at '{self.path}' closed the connection.")
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(f"Analyzer service error: {response['error']}")
+        return response
+
+    def ping(self) -> dict:
+        return self.request({"ping": True})
+
+    def analyze(self, sentences) -> list:
+        response = self.request({"sentences": list(sentences)})
+        metrics.observe("service.inference_ms", response.get("inference_ms", 0.0))
+        return response["words"]
+
+
+class ServiceModel:
+    """
+    run_processor() にモデルの代わりに渡すオブジェクト。
+    サービスに接続できなくなったら、その時点で自分のプロセスにモデルをロードして処理を続ける。
+    """
+
+    def __init__(self, client: AnalyzerClient, model_loader_func, batch_processor_func):
+        self.client = client
+        self.model_loader_func = model_loader_func
+        self.batch_processor_func = batch_processor_func
+        self.local_model = None
+
+    def _load_local(self, reason: Exception):
+        print(f"\n[!] Analyzer service unavailable ({reason}). Loading the model in this process.", file=sys.stderr)
+        metrics.incr("service.fallbacks")
+        self.client.close()
+        with metrics.timer("nlp.model_load_ms"):
+            self.local_model = self.model_loader_func()
+
+    def process(self, sentences) -> list:
+        if self.local_model is None:
+            try:
+                return self.client.analyze(sentences)
+            except OSError as e:
+                # 一度だけ接続し直し、それでも駄目ならローカルのモデルに切り替える
+                try:
+                    return self.client.analyze(sentences)
+                except OSError:
+                    self._load_local(e)
+        return self.batch_processor_func(sentences, self.local_model)
+
+
+def process_batch_with_service(sentences, model: ServiceModel):
+    """batch_processor_funcと同じ形式 (文のリスト, モデル) で呼べるようにしたもの"""
+    return model.process(sentences)
+
+
+def connect(config, name: str):
+    """サービスが起動していて応答すればクライアントを、そうでなければNoneを返す"""
+    path = socket_path(config, name)
+    if not os.path.exists(path):
+        return None
+    timeout = config.getfloat('AnalyzerService', 'REQUEST_TIMEOUT_SECONDS', fallback=600.0)
+    client = AnalyzerClient(path, timeout=timeout)
+    try:
+        info = client.ping()
+    except (OSError, RuntimeError, ValueError) as e:
+        print(f"[!] Ignoring analyzer service at '{path}': {e}", file=sys.stderr)
+        client.close()
+        return None
+    if info.get("analyzer") != name:
+        print(f"[!] Ignoring analyzer service at '{path}': it serves '{info.get('analyzer')}'.", file=sys.stderr)
+        client.close()
+        return None
+    print(f"[+] Using analyzer service at '{path}' (pid {info.get('pid')}, "
+          f"model loaded in {info.get('model_load_ms', 0):.0f} ms, up {info.get('uptime_sec', 0):.0f}s).")
+    return client
+
+
+# --- Server ---
+class _AnalyzerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, name: str, model, batch_processor_func, model_load_ms: float):
+        super().__init__(path, _RequestHandler)
+        self.name = name
+        self.model = model
+        self.batch_processor_func = batch_processor_func
+        self.model_load_ms = model_load_ms
+        self.started_at = time.time()
+        self.batches = 0
+        # モデルはスレッドセーフとは限らないため、解析は1バッチずつ行う
+        self.model_lock = threading.Lock()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server
+        metrics.incr("service.connections")
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if request.get("ping"):
+                    response = {"analyzer": server.name, "pid": os.getpid(),
+                                "model_load_ms": round(server.model_load_ms, 1),
+                                "uptime_sec": round(time.time() - server.started_at, 1),
+                                "batches": server.batches}
+                else:
+                    sentences = request["sentences"]
+                    start = time.perf_counter()
+                    with server.model_lock:
+                        words = server.batch_processor_func(sentences, server.model)
+                        server.batches += 1
+                    elapsed_ms = (time.perf_counter() - start) * 1000.0
+                    metrics.observe("nlp.inference_ms", elapsed_ms)
+                    metrics.incr("nlp.sentences", len(sentences))
+                    metrics.incr("nlp.words_found", len(words))
+                    response = {"words": words, "inference_ms": round(elapsed_ms, 3)}
+            except Exception as e:
+                metrics.incr("service.errors")
+                response = {"error": f"{type(e).__name__}: {e}"}
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+def _resolve_analyzer(name: str, module: str = None) -> dict:
+    from process_common import ANALYZERS
+    if name not in ANALYZERS:
+        importlib.import_module(module or ANALYZER_MODULES.get(name, f"process_{name}"))
+    if name not in ANALYZERS:
+        raise KeyError(f"Analyzer '{name}' was not registered by module '{module or ANALYZER_MODULES.get(name)}'.")
+    return ANALYZERS[name]
+
+
+def serve(name: str, config, module: str = None, path: str = None):
+    """モデルをロードし、停止されるまでソケットでリクエストを受け付ける"""
+    analyzer = _resolve_analyzer(name, module)
+    path = path or socket_path(config, name)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    probe = AnalyzerClient(path, timeout=5.0)
+    if os.path.exists(path):
+        try:
+            probe.ping()
+        except (OSError, RuntimeError, ValueError):
+            os.remove(path)  # 前回異常終了したサービスのソケットが残っている
+        else:
+            probe.close()
+            raise RuntimeError(f"An analyzer service is already listening on '{path}'.")
+
+    metrics.start(f"service-{name}", config)
+    print(f"--- [{analyzer['display_name']} service] Started ---")
+    print(f"[*] Loading {analyzer['display_name']} model...")
+    start = time.perf_counter()
+    model = analyzer["model_loader_func"]()
+    model_load_ms = (time.perf_counter() - start) * 1000.0
+    metrics.observe("nlp.model_load_ms", model_load_ms)
+    metrics.observe("startup.ready_ms", metrics.process_age_ms())
+    print(f"[+] {analyzer['display_name']} model loaded in {model_load_ms:.0f} ms.")
+
+    server = _AnalyzerServer(path, name, model, analyzer["batch_processor_func"], model_load_ms)
+    # SIGTERMでもCtrl-Cと同じように後片付けして終了する
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    print(f"[*] Listening on '{path}'.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+        print(f"[*] Served {server.batches} batches.")
+        metrics.finish()
+        print(f"--- [{analyzer['display_name']} service] Stopped ---")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep an analyzer model loaded and serve sentence batches over a Unix socket.")
+    parser.add_argument('analyzer', help="Analyzer name (e.g. ginza, stanza).")
+    parser.add_argument('--module', help="Module that registers the analyzer (default: process_<analyzer>).")
+    parser.add_argument('--socket', help="Socket path (default: <[AnalyzerService] SOCKET_DIR>/<analyzer>.sock).")
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    try:
+        serve(args.analyzer, config, module=args.module, path=args.socket)
+    except (KeyError, RuntimeError) as e:
+        print(f"[!] {e}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+# analyzers.py
+"""
+解析器名と、importすると register_analyzer() で自分を登録するモジュールの対応。
+
+check_queue.py は supabase だけで動く軽いジョブから呼ばれるため、
+ここには外部ライブラリに依存するものを置かない。
+解析器を追加するときはここに1行足す (process_common.py / analyzer_service.py / check_queue.py が使う)。
+"""
+
+ANALYZER_MODULES = {
+    "ginza": "process_ginza",
+    "stanza": "process_stanza",
+}
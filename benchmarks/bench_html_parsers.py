@@ -0,0 +1,147 @@
+# benchmarks/bench_html_parsers.py
+"""
+保存済みのMHLWページを使って、HTML解析バックエンドの速度と結果の一致を比較する。
+
+    python -m benchmarks.bench_html_parsers --pages-dir benchmarks/pages
+    python -m benchmarks.bench_html_parsers --pages-dir benchmarks/pages --fetch   # Seedsのページを保存してから計測
+    python -m benchmarks.bench_html_parsers --pages-dir benchmarks/fixtures/site     # 同梱のフィクスチャで計測
+
+html5lib(従来実装)を基準とし、他のバックエンドのリンク集合が一致しない場合は終了コード1で終わる。
+"""
+import os
+import sys
+import time
+import argparse
+import configparser
+import hashlib
+from urllib.parse import urljoin
+
+import requests
+from url_normalize import url_normalize
+
+from html_parsing import BACKENDS, extract_links, extract_main_text, resolve_backend
+
+REFERENCE_BACKEND = "html5lib"
+
+
+def fetch_seed_pages(pages_dir: str):
+    """config.iniのSeedsに列挙されたページをpages_dirに保存する"""
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    seeds = [u for u in config.get('Seeds', 'INDEX_PAGES').strip().split('\n') if u]
+    timeout = config.getint('General', 'REQUEST_TIMEOUT')
+    os.makedirs(pages_dir, exist_ok=True)
+    for url in seeds:
+        try:
+            response = requests.get(url, timeout=timeout, headers={'User-Agent': 'Mozilla/5.0'})
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            print(f"  [!] Failed to fetch {url}: {e}", file=sys.stderr)
+            continue
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16] + ".html"
+        with open(os.path.join(pages_dir, name), 'wb') as f:
+            f.write(response.content)
+        print(f"  [+] Saved {url} -> {name}")
+        time.sleep(1.0)
+
+
+def load_pages(pages_dir: str) -> list:
+    pages = []
+    for root, _, names in sorted(os.walk(pages_dir)):
+        for name in sorted(names):
+            if name.lower().endswith(('.html', '.htm')):
+                path = os.path.join(root, name)
+                with open(path, 'rb') as f:
+                    pages.append((os.path.relpath(path, pages_dir), f.read()))
+    return pages
+
+
+def resolved_link_set(hrefs, base_url: str) -> set:
+    """discover_urls.worker_fetch_linksと同じ手順でURLを正規化する"""
+    links = set()
+    for href in hrefs:
+        try:
+            links.add(url_normalize(urljoin(base_url, href)))
+        except Exception:
+            pass
+    return links
+
+
+def time_backend(func, pages, backend: str, repeat: int):
+    results = {}
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for name, content in pages:
+            results[name] = func(content, backend=backend)
+    elapsed = time.perf_counter() - start
+    return elapsed, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HTML parser backends against html5lib.")
+    parser.add_argument('--pages-dir', default='benchmarks/pages', help="Directory of saved HTML pages (searched recursively).")
+    parser.add_argument('--fetch', action='store_true', help="Download the seed pages into --pages-dir first.")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of passes over the corpus per backend.")
+    parser.add_argument('--base-url', default='https://www.mhlw.go.jp/', help="Base URL used to resolve relative links.")
+    args = parser.parse_args()
+
+    if args.fetch:
+        fetch_seed_pages(args.pages_dir)
+
+    if not os.path.isdir(args.pages_dir):
+        print(f"[!] Pages directory not found: {args.pages_dir}", file=sys.stderr)
+        sys.exit(2)
+    pages = load_pages(args.pages_dir)
+    if not pages:
+        print(f"[!] No HTML pages found in {args.pages_dir}", file=sys.stderr)
+        sys.exit(2)
+
+    total_bytes = sum(len(c) for _, c in pages)
+    print(f"--- HTML Parser Benchmark ({len(pages)} pages, {total_bytes / 1024:.0f} KiB, x{args.repeat}) ---")
+
+    backends = []
+    for name in BACKENDS:
+        if resolve_backend(name) == name and name not in backends:
+            backends.append(name)
+
+    timings = {}
+    link_results = {}
+    text_results = {}
+    for backend in backends:
+        link_sec, link_results[backend] = time_backend(extract_links, pages, backend, args.repeat)
+        text_sec, text_results[backend] = time_backend(extract_main_text, pages, backend, args.repeat)
+        timings[backend] = (link_sec, text_sec)
+
+    ref_links, ref_texts = link_results[REFERENCE_BACKEND], text_results[REFERENCE_BACKEND]
+    ref_link_sec, ref_text_sec = timings[REFERENCE_BACKEND]
+    mismatched = False
+
+    print(f"{'backend':<12} {'links ms/page':>14} {'text ms/page':>13} {'speedup':>8} {'link sets':>10} {'text':>10}")
+    for backend in backends:
+        link_sec, text_sec = timings[backend]
+        per_page = len(pages) * args.repeat
+        same_links = sum(
+            1 for name, _ in pages
+            if resolved_link_set(link_results[backend][name], args.base_url) == resolved_link_set(ref_links[name], args.base_url)
+        )
+        same_text = sum(1 for name, _ in pages if text_results[backend][name] == ref_texts[name])
+        speedup = (ref_link_sec + ref_text_sec) / (link_sec + text_sec) if (link_sec + text_sec) else float('inf')
+        print(f"{backend:<12} {link_sec * 1000 / per_page:>14.2f} {text_sec * 1000 / per_page:>13.2f} "
+              f"{speedup:>7.1f}x {same_links:>4}/{len(pages):<5} {same_text:>4}/{len(pages):<5}")
+
+        for name, _ in pages:
+            got = resolved_link_set(link_results[backend][name], args.base_url)
+            expected = resolved_link_set(ref_links[name], args.base_url)
+            if got != expected:
+                mismatched = True
+                print(f"   [!] {backend}: link set differs for {name} "
+                      f"(missing {len(expected - got)}, extra {len(got - expected)})", file=sys.stderr)
+
+    if mismatched:
+        print("[!] Link sets are not identical to html5lib.", file=sys.stderr)
+        sys.exit(1)
+    print("[+] All backends produced identical link sets.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# benchmarks/check_adaptive_concurrency.py
+"""
+AdaptiveConcurrency (adaptive_concurrency.py) の挙動を、仮想時計を使った離散イベント・シミュレーションで確認する。
+
+- healthy   : 負荷に関係なくレイテンシがばらつくだけのサーバー。上限は max_limit 付近に留まるべき
+- congested : capacity を超えた同時リクエストに比例して遅くなるサーバー。上限は max_limit より十分下がるべき
+
+    python -m benchmarks.check_adaptive_concurrency
+    python -m benchmarks.check_adaptive_concurrency --requests 5000 --sigma 0.3 0.6 0.8
+
+条件を満たさなければ終了コード1で終わる。
+"""
+import sys
+import heapq
+import random
+import argparse
+import statistics
+
+from adaptive_concurrency import AdaptiveConcurrency
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def simulate(requests: int, sigma: float, median_ms: float = 200.0, capacity: int = 0,
+             max_limit: int = 16, seed: int = 1) -> list:
+    """requests件の応答を処理し、応答ごとの同時実行数の上限を返す"""
+    rng = random.Random(seed)
+    clock = _Clock()
+    controller = AdaptiveConcurrency(initial=2, min_limit=1, max_limit=max_limit, clock=clock)
+    in_flight = []
+    limits = []
+
+    def launch():
+        while controller.acquire(block=False):
+            latency = rng.lognormvariate(0.0, sigma) * median_ms / 1000.0
+            if capacity:
+                # サーバーが同時に処理できる数を超えた分だけ待たされる
+                latency *= max(1.0, (controller.in_flight) / capacity)
+            heapq.heappush(in_flight, (clock.now + latency, latency))
+
+    launch()
+    for _ in range(requests):
+        clock.now, latency = heapq.heappop(in_flight)
+        controller.release(latency=latency, status_code=200)
+        limits.append(controller.limit)
+        launch()
+    return limits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the AIMD concurrency controller.")
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--sigma', type=float, nargs='+', default=[0.3, 0.6, 0.8],
+                        help="Lognormal sigma of the simulated latency.")
+    parser.add_argument('--max-limit', type=int, default=16)
+    parser.add_argument('--capacity', type=int, default=4)
+    args = parser.parse_args()
+
+    failures = 0
+    for sigma in args.sigma:
+        limits = simulate(args.requests, sigma, max_limit=args.max_limit)
+        steady = limits[len(limits) // 3:]
+        mean, low = statistics.mean(steady), min(steady)
+        ok = mean >= 0.8 * args.max_limit
+        failures += not ok
+        print(f"[{'+' if ok else '!'}] healthy   sigma={sigma:.1f}: mean limit {mean:.1f} (min {low}) / max {args.max_limit}")
+
+    limits = simulate(args.requests, 0.3, capacity=args.capacity, max_limit=args.max_limit)
+    steady = limits[len(limits) // 3:]
+    mean = statistics.mean(steady)
+    # LATENCY_TOLERANCE = 2 ならレイテンシが2倍になる capacity の2倍前後で落ち着くはず
+    ok = args.capacity / 2 <= mean <= 3 * args.capacity and mean < 0.8 * args.max_limit
+    failures += not ok
+    print(f"[{'+' if ok else '!'}] congested capacity={args.capacity}: mean limit {mean:.1f} / max {args.max_limit}")
+
+    if failures:
+        print(f"[!] {failures} scenario(s) failed.", file=sys.stderr)
+        sys.exit(1)
+    print("[+] All scenarios passed.")
+
+
+if __name__ == "__main__":
+    main()
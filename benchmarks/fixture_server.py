@@ -0,0 +1,215 @@
+# benchmarks/fixture_server.py
+"""
+ベンチマーク用に mhlw.go.jp の代わりをするローカルHTTPサーバー。
+
+- benchmarks/fixtures/site 以下の保存済みページ (HTML/PDF) をそのまま返す
+- /bench/ 以下に、件数を指定した合成ページ (医療用語を含む本文とリンク) を生成して返す
+- 応答遅延 (固定 + ゆらぎ) と 503 / 429 の注入ができる
+- --capacity を指定すると、同時接続数がそれを超えた分だけ遅くなり、2倍を超えると503を返す (混雑の再現)
+
+    python -m benchmarks.fixture_server --port 8800 --latency-ms 50 --error-rate 0.05
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+import mimetypes
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, unquote
+
+FIXTURE_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'site')
+
+_TERMS = [
+    "結核菌", "多剤耐性結核", "麻しん", "風しん", "百日咳", "腸管出血性大腸菌", "新型インフルエンザ",
+    "抗インフルエンザウイルス薬", "指定難病", "緩和ケア", "がん検診", "特定健康診査", "後発医薬品",
+    "薬剤耐性菌", "院内感染対策", "在宅医療", "地域包括ケアシステム", "医療用医薬品", "再生医療等製品",
+    "ゲノム医療", "遠隔診療", "抗原定性検査", "ワクチン接種", "副反応疑い報告", "肝炎ウイルス",
+]
+_TEMPLATES = [
+    "{0}の発生状況について、都道府県から報告された件数を取りまとめました。",
+    "{0}に関する診療の手引きを改訂し、医療機関向けに周知しています。",
+    "{0}と{1}の関係について、専門家会議で検討が行われました。",
+    "国民の皆様には、{0}の予防のため、手洗いや{1}への理解をお願いします。",
+    "{0}の対策として、{1}の体制整備を進めることとしています。",
+]
+
+
+def render_synthetic_page(index: int, total: int, sentences: int, links: int) -> bytes:
+    """合成ページを決定的に生成する (同じindexなら常に同じ内容)"""
+    rng = random.Random(index)
+    body = []
+    for _ in range(sentences):
+        template = rng.choice(_TEMPLATES)
+        body.append(f"<p>{template.format(rng.choice(_TERMS), rng.choice(_TERMS))}</p>")
+    targets = sorted({rng.randrange(total) for _ in range(links)}) if total else []
+    anchors = "".join(f'<li><a href="/bench/{t:05d}.html">関連情報 {t}</a></li>' for t in targets)
+    html = (
+        '<!DOCTYPE html><html lang="ja"><head><meta charset="UTF-8">'
+        f'<title>ベンチマーク用ページ {index}</title></head><body>'
+        '<header><a href="/">厚生労働省</a></header>'
+        '<nav><ul><li><a href="/stf/houdou/">報道・広報</a></li><li><a href="/bench/">一覧</a></li></ul></nav>'
+        f'<main><h1>ベンチマーク用ページ {index}</h1>{"".join(body)}<ul>{anchors}</ul></main>'
+        '<footer>Copyright © Ministry of Health, Labour and Welfare</footer></body></html>'
+    )
+    return html.encode('utf-8')
+
+
+def render_synthetic_index(total: int) -> bytes:
+    anchors = "".join(f'<li><a href="{i:05d}.html">ページ {i}</a></li>' for i in range(total))
+    html = ('<!DOCTYPE html><html lang="ja"><head><meta charset="UTF-8"><title>一覧</title></head>'
+            f'<body><main><h1>ベンチマーク用ページ一覧</h1><ul>{anchors}</ul></main></body></html>')
+    return html.encode('utf-8')
+
+
+class FixtureRequestHandler(BaseHTTPRequestHandler):
+    server_version = "MHLWFixture/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status: int, body: bytes, content_type: str, extra_headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (extra_headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _inject_faults(self) -> bool:
+        server = self.server
+        with server.stats_lock:
+            server.request_count += 1
+            in_flight = server.in_flight
+        delay = server.latency_ms + server.rng.uniform(-server.jitter_ms, server.jitter_ms)
+        overloaded = False
+        if server.capacity and in_flight > server.capacity:
+            delay *= in_flight / server.capacity
+            overloaded = in_flight > server.capacity * 2
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        roll = server.rng.random()
+        if overloaded or roll < server.error_rate:
+            with server.stats_lock:
+                server.error_count += 1
+            status = 429 if roll < server.error_rate * server.throttle_share else 503
+            # retry_afterが0ならRetry-Afterを付けない (クライアント側のバックオフを確認する用)
+            headers = {"Retry-After": str(server.retry_after)} if server.retry_after else {}
+            self._send(status, b"Service Unavailable", "text/plain", headers)
+            return True
+        return False
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        with self.server.stats_lock:
+            self.server.in_flight += 1
+            self.server.peak_in_flight = max(self.server.peak_in_flight, self.server.in_flight)
+        try:
+            self._handle_get()
+        finally:
+            with self.server.stats_lock:
+                self.server.in_flight -= 1
+
+    def _handle_get(self):
+        if self._inject_faults():
+            return
+        path = unquote(urlparse(self.path).path)
+
+        if path in ("/bench", "/bench/"):
+            self._send(200, render_synthetic_index(self.server.synthetic_pages), "text/html; charset=UTF-8")
+            return
+        if path.startswith("/bench/") and path.endswith(".html"):
+            try:
+                index = int(os.path.basename(path)[:-5])
+            except ValueError:
+                index = -1
+            if 0 <= index < self.server.synthetic_pages:
+                body = render_synthetic_page(index, self.server.synthetic_pages,
+                                             self.server.sentences_per_page, self.server.links_per_page)
+                self._send(200, body, "text/html; charset=UTF-8")
+                return
+            self._send(404, b"Not Found", "text/plain")
+            return
+
+        file_path = os.path.normpath(os.path.join(self.server.root, path.lstrip("/")))
+        if not file_path.startswith(self.server.root):
+            self._send(403, b"Forbidden", "text/plain")
+            return
+        if os.path.isdir(file_path):
+            file_path = os.path.join(file_path, "index.html")
+        if not os.path.isfile(file_path):
+            self._send(404, b"Not Found", "text/plain")
+            return
+        with open(file_path, "rb") as f:
+            body = f.read()
+        # 古いページと同様に、HTMLはcharsetなしのContent-Typeで返して<meta>による判定を通す
+        content_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+        self._send(200, body, content_type)
+
+
+def start_server(port: int = 0, latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0,
+                 throttle_share: float = 0.5, retry_after: int = 1, capacity: int = 0, synthetic_pages: int = 200,
+                 sentences_per_page: int = 30, links_per_page: int = 10, root: str = FIXTURE_ROOT,
+                 seed: int = 0, verbose: bool = False):
+    """
+    バックグラウンドスレッドでサーバーを起動し、(server, base_url) を返す。
+    停止するときは server.shutdown() を呼ぶ。
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FixtureRequestHandler)
+    server.daemon_threads = True
+    server.root = os.path.abspath(root)
+    server.latency_ms = latency_ms
+    server.jitter_ms = jitter_ms
+    server.error_rate = error_rate
+    server.throttle_share = throttle_share
+    server.retry_after = retry_after
+    server.capacity = capacity
+    server.synthetic_pages = synthetic_pages
+    server.sentences_per_page = sentences_per_page
+    server.links_per_page = links_per_page
+    server.verbose = verbose
+    server.rng = random.Random(seed)
+    server.stats_lock = threading.Lock()
+    server.request_count = 0
+    server.error_count = 0
+    server.in_flight = 0
+    server.peak_in_flight = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for mhlw.go.jp.")
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Base response latency.")
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help="Uniform +/- jitter added to the latency.")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Probability of answering 503/429.")
+    parser.add_argument('--capacity', type=int, default=0,
+                        help="Concurrent requests served at full speed (0 = unlimited).")
+    parser.add_argument('--synthetic-pages', type=int, default=200, help="Number of generated pages under /bench/.")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    server, base_url = start_server(args.port, args.latency_ms, args.jitter_ms, args.error_rate,
+                                    capacity=args.capacity, synthetic_pages=args.synthetic_pages,
+                                    verbose=args.verbose)
+    print(f"[*] Serving fixtures from {server.root} at {base_url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(f"\n[*] Served {server.request_count} requests ({server.error_count} injected errors).")
+        server.shutdown()
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
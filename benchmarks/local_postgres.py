@@ -0,0 +1,60 @@
+# benchmarks/local_postgres.py
+"""
+ベンチマーク用の使い捨てPostgreSQL。
+
+環境変数 BENCH_DB_URL が設定されていればそれを使う (テーブルは作り直される)。
+未設定の場合は initdb / pg_ctl で一時ディレクトリにクラスタを作成し、終了時に削除する。
+"""
+import os
+import glob
+import shutil
+import socket
+import tempfile
+import subprocess
+from contextlib import contextmanager
+
+
+def _find_pg_bin(name: str):
+    path = shutil.which(name)
+    if path:
+        return path
+    # Debian/Ubuntuのpostgresqlパッケージは PATH に入らない場所にインストールされる
+    candidates = sorted(glob.glob(f"/usr/lib/postgresql/*/bin/{name}"), reverse=True)
+    return candidates[0] if candidates else None
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def throwaway_postgres():
+    """接続URLをyieldし、終了時に一時クラスタを停止・削除する"""
+    env_url = os.environ.get("BENCH_DB_URL")
+    if env_url:
+        yield env_url
+        return
+
+    initdb, pg_ctl = _find_pg_bin("initdb"), _find_pg_bin("pg_ctl")
+    if not initdb or not pg_ctl:
+        raise RuntimeError("PostgreSQL server binaries (initdb/pg_ctl) were not found. "
+                           "Install postgresql or set BENCH_DB_URL to a scratch database.")
+
+    data_dir = tempfile.mkdtemp(prefix="mtc-bench-pg-")
+    port = _free_port()
+    log_path = os.path.join(data_dir, "postgres.log")
+    try:
+        subprocess.run([initdb, "-D", data_dir, "-U", "bench", "--auth=trust", "-E", "UTF8", "--no-locale"],
+                       check=True, stdout=subprocess.DEVNULL)
+        options = f"-p {port} -k {data_dir} -c listen_addresses=127.0.0.1 -c fsync=off"
+        subprocess.run([pg_ctl, "-D", data_dir, "-o", options, "-l", log_path, "-w", "start"],
+                       check=True, stdout=subprocess.DEVNULL)
+        try:
+            yield f"postgresql://bench@127.0.0.1:{port}/postgres"
+        finally:
+            subprocess.run([pg_ctl, "-D", data_dir, "-m", "immediate", "-w", "stop"],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
@@ -0,0 +1,335 @@
+# benchmarks/run_benchmarks.py
+"""
+オフラインのエンドツーエンド・ベンチマーク。
+
+ローカルのフィクスチャサーバー (benchmarks/fixture_server.py) と使い捨てのPostgreSQLを使い、
+discover_urls → preprocess → run_processor → score_terms → sync_to_supabase を順に実行してスループットを測る。
+startupステージでは、各スクリプトのモジュールを新しいインタープリターでimportするのにかかる時間を測る。
+NLPモデルとSupabaseはスタブ (benchmarks/stubs.py) を使うため、外部には一切アクセスしない。
+
+    python -m benchmarks.run_benchmarks
+    python -m benchmarks.run_benchmarks --synthetic-pages 500 --latency-ms 30 --error-rate 0.02
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/<前回>.json
+    python -m benchmarks.run_benchmarks --analyzer-service   # processステージをanalyzer_service.py経由で実行
+
+結果は benchmarks/results/<日時>-<コミット>.json に保存される。
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import configparser
+from datetime import datetime, timezone
+
+from benchmarks.fixture_server import start_server
+from benchmarks.local_postgres import throwaway_postgres
+from benchmarks.stubs import StubSupabaseClient
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ("startup", "discover", "preprocess", "process", "score", "sync")
+# startupステージでimport時間を測るモジュール
+STARTUP_MODULES = ("db_utils", "process_common", "process_ginza", "process_stanza", "preprocess", "sync_to_supabase")
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def write_bench_config(path: str, base_url: str, args, metrics_file: str):
+    """リポジトリのconfig.iniを元に、接続先と並列数だけをベンチマーク用に差し替える"""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(REPO_ROOT, 'config.ini'))
+    netloc = base_url.split("//", 1)[1].rstrip("/")
+    config['General']['START_URL'] = base_url
+    config['General']['TARGET_DOMAIN'] = netloc
+    config['General']['REQUEST_DELAY_SECONDS'] = str(args.request_delay)
+    config['Seeds']['INDEX_PAGES'] = "\n" + "\n".join([base_url, base_url + "stf/houdou/", base_url + "bench/"])
+    config['Discoverer']['CRAWL_DEPTH'] = str(args.crawl_depth)
+    config['Discoverer']['MAX_DISCOVER_WORKERS'] = str(args.discover_workers)
+    config['Preprocessor']['MAX_WORKERS'] = str(args.preprocess_workers)
+    config['Preprocessor']['SUDACHI_DICT_TYPE'] = args.sudachi_dict
+    config['Processor']['SAFE_RUN_DURATION_MINUTES'] = '0'
+    if not config.has_section('AnalyzerService'):
+        config.add_section('AnalyzerService')
+    config['AnalyzerService']['ENABLED'] = str(args.analyzer_service).lower()
+    if not config.has_section('Concurrency'):
+        config.add_section('Concurrency')
+    config['Concurrency']['ADAPTIVE'] = str(not args.fixed_concurrency).lower()
+    if not config.has_section('Archive'):
+        config.add_section('Archive')
+    config['Archive']['WARC_DIR'] = ''
+    if not config.has_section('Metrics'):
+        config.add_section('Metrics')
+    config['Metrics']['METRICS_FILE'] = metrics_file
+    with open(path, 'w', encoding='utf-8') as f:
+        config.write(f)
+
+
+def reset_schema():
+    from sqlalchemy import create_engine
+    from db_utils import Base
+    engine = create_engine(os.environ["LOCAL_DB_URL"])
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    engine.dispose()
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def rate(count: int, seconds: float) -> float:
+    return round(count / seconds, 2) if seconds > 0 else 0.0
+
+
+def run_startup(repeat: int = 3) -> dict:
+    """各モジュールを新しいインタープリターでimportし、起動から終了までの時間の中央値を返す"""
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    results = {}
+    for module in ("", *STARTUP_MODULES):
+        code = f"import {module}" if module else "pass"
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            completed = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, env=env,
+                                       capture_output=True, text=True)
+            samples.append((time.perf_counter() - start) * 1000.0)
+            if completed.returncode != 0:
+                print(f"  [!] import {module} failed: {completed.stderr.strip().splitlines()[-1]}", file=sys.stderr)
+                break
+        else:
+            results[f"import_{module or 'python'}_ms"] = round(sorted(samples)[len(samples) // 2], 1)
+    return results
+
+
+def start_analyzer_service(workdir: str):
+    """スタブの解析器 "bench" をanalyzer_service.pyで起動し、ソケットが応答するまで待つ"""
+    import analyzer_service
+
+    config = configparser.ConfigParser()
+    config.read(os.path.join(workdir, 'config.ini'))
+    path = os.path.join(workdir, analyzer_service.socket_path(config, "bench"))
+    process = subprocess.Popen([sys.executable, "-m", "analyzer_service", "bench", "--module", "benchmarks.stubs"],
+                               cwd=workdir, env=dict(os.environ, PYTHONPATH=REPO_ROOT))
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if os.path.exists(path) and analyzer_service.connect(config, "bench") is not None:
+            return process
+        if process.poll() is not None:
+            raise RuntimeError("Analyzer service exited before it started listening.")
+        time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Analyzer service did not start within 30 seconds.")
+
+
+def run_discover() -> dict:
+    import discover_urls
+    from db_utils import get_local_db_session, CrawlQueue
+
+    sys.argv = ["discover_urls.py"]
+    seconds = timed(discover_urls.main)
+    session = get_local_db_session()
+    try:
+        queued = session.query(CrawlQueue).count()
+    finally:
+        session.close()
+    pages = len(discover_urls.visited_urls)
+    return {"seconds": round(seconds, 3), "pages": pages, "urls_queued": queued,
+            "pages_per_sec": rate(pages, seconds)}
+
+
+def run_preprocess() -> dict:
+    import preprocess
+    from db_utils import get_local_db_session, CrawlQueue, SentenceQueue
+
+    sys.argv = ["preprocess.py"]
+    seconds = timed(preprocess.main)
+    session = get_local_db_session()
+    try:
+        urls = session.query(CrawlQueue).filter(CrawlQueue.extraction_status != 'queued').count()
+        sentences = session.query(SentenceQueue).count()
+    finally:
+        session.close()
+    return {"seconds": round(seconds, 3), "urls": urls, "sentences": sentences,
+            "urls_per_sec": rate(urls, seconds), "sentences_per_sec": rate(sentences, seconds)}
+
+
+def run_process() -> dict:
+    from process_common import run_analyzer, analyzer_watermark
+    from db_utils import get_local_db_session, SentenceQueue
+
+    seconds = timed(lambda: run_analyzer("bench"))
+    session = get_local_db_session()
+    try:
+        sentences = session.query(SentenceQueue).filter(SentenceQueue.id <= analyzer_watermark(session, "bench")).count()
+    finally:
+        session.close()
+    return {"seconds": round(seconds, 3), "sentences": sentences, "sentences_per_sec": rate(sentences, seconds)}
+
+
+def run_score() -> dict:
+    import score_terms
+    from db_utils import get_local_db_session, TermScore
+
+    sys.argv = ["score_terms.py", "--full"]
+    seconds = timed(score_terms.main)
+    session = get_local_db_session()
+    try:
+        terms = session.query(TermScore).count()
+    finally:
+        session.close()
+    return {"seconds": round(seconds, 3), "terms": terms, "terms_per_sec": rate(terms, seconds)}
+
+
+def run_sync(latency_ms: float) -> dict:
+    import sync_to_supabase
+
+    client = StubSupabaseClient(latency_ms=latency_ms)
+    original = sync_to_supabase.get_supabase_client
+    sync_to_supabase.get_supabase_client = lambda: client
+    try:
+        seconds = timed(sync_to_supabase.main)
+    finally:
+        sync_to_supabase.get_supabase_client = original
+    rows = sum(client.rows_upserted.values())
+    return {"seconds": round(seconds, 3), "rows": rows, "requests": client.requests,
+            "rows_per_sec": rate(rows, seconds)}
+
+
+def print_comparison(current: dict, previous_path: str):
+    with open(previous_path, encoding='utf-8') as f:
+        previous = json.load(f)
+    print(f"\n--- Comparison with {previous.get('commit')} ({os.path.basename(previous_path)}) ---")
+    for stage, metrics in current["results"].items():
+        old_metrics = previous.get("results", {}).get(stage, {})
+        for key, value in metrics.items():
+            if not key.endswith(("_per_sec", "_ms")) or key not in old_metrics:
+                continue
+            old = old_metrics[key]
+            change = (value - old) / old * 100 if old else float('inf')
+            print(f"  {stage:<11} {key:<24} {old:>10.2f} -> {value:>10.2f} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end throughput benchmark.")
+    parser.add_argument('--stages', default=",".join(STAGES), help="Comma separated stages to run.")
+    parser.add_argument('--synthetic-pages', type=int, default=200)
+    parser.add_argument('--sentences-per-page', type=int, default=30)
+    parser.add_argument('--links-per-page', type=int, default=10)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--jitter-ms', type=float, default=5.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After seconds sent with injected errors (0 = no header).")
+    parser.add_argument('--capacity', type=int, default=0,
+                        help="Concurrent requests the fixture server handles before slowing down (0 = unlimited).")
+    parser.add_argument('--crawl-depth', type=int, default=3)
+    parser.add_argument('--discover-workers', type=int, default=4)
+    parser.add_argument('--preprocess-workers', type=int, default=4)
+    parser.add_argument('--request-delay', type=float, default=0.0)
+    parser.add_argument('--fixed-concurrency', action='store_true',
+                        help="Disable the adaptive concurrency controller and use the fixed worker counts.")
+    parser.add_argument('--analyzer-service', action='store_true',
+                        help="Run the process stage against analyzer_service.py instead of loading the model in-process.")
+    parser.add_argument('--sudachi-dict', default='core', help="Sudachi dictionary used by preprocess (core/full).")
+    parser.add_argument('--supabase-latency-ms', type=float, default=0.0, help="Simulated latency per upsert.")
+    parser.add_argument('--output-dir', default=os.path.join(REPO_ROOT, 'benchmarks', 'results'))
+    parser.add_argument('--compare', help="Previous result JSON to compare against.")
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stage(s): {', '.join(sorted(unknown))}")
+
+    report = {
+        "commit": git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "parameters": {k: v for k, v in vars(args).items() if k not in ("output_dir", "compare")},
+        "results": {},
+    }
+
+    # 各スクリプトはカレントディレクトリのconfig.iniを読むため、一時ディレクトリに移動して実行する
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    os.makedirs(args.output_dir, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')
+    output_path = os.path.join(args.output_dir, f"{stamp}-{report['commit']}.json")
+    # 各ステージのメトリクス (metrics.py) はJSON Linesとして結果の横に保存する
+    metrics_path = os.path.abspath(output_path[:-len(".json")] + ".metrics.jsonl")
+    report["metrics_file"] = os.path.basename(metrics_path)
+
+    original_cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="mtc-bench-")
+    server = None
+    service = None
+    print("--- Offline Benchmark Started ---")
+    try:
+        with throwaway_postgres() as db_url:
+            os.environ["LOCAL_DB_URL"] = db_url
+            server, base_url = start_server(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                            error_rate=args.error_rate, retry_after=args.retry_after,
+                                            capacity=args.capacity,
+                                            synthetic_pages=args.synthetic_pages,
+                                            sentences_per_page=args.sentences_per_page,
+                                            links_per_page=args.links_per_page)
+            print(f"[*] Fixture server: {base_url}")
+            print(f"[*] Local database: {db_url}")
+
+            write_bench_config(os.path.join(workdir, 'config.ini'), base_url, args, metrics_path)
+            os.chdir(workdir)
+            reset_schema()
+            if args.analyzer_service and "process" in stages:
+                service = start_analyzer_service(workdir)
+
+            runners = {
+                "startup": run_startup,
+                "discover": run_discover,
+                "preprocess": run_preprocess,
+                "process": run_process,
+                "score": run_score,
+                "sync": lambda: run_sync(args.supabase_latency_ms),
+            }
+            for stage in stages:
+                print(f"\n[*] Stage: {stage}")
+                report["results"][stage] = runners[stage]()
+                print(f"[+] {stage}: {report['results'][stage]}")
+
+            report["server"] = {"requests": server.request_count, "injected_errors": server.error_count,
+                                "peak_in_flight": server.peak_in_flight}
+    finally:
+        if service:
+            service.terminate()
+            service.wait(timeout=30)
+        if server:
+            server.shutdown()
+        os.chdir(original_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print("\n--- Summary ---")
+    for stage, metrics in report["results"].items():
+        rates = ", ".join(f"{k}={v}" for k, v in metrics.items() if k.endswith(("_per_sec", "_ms")))
+        print(f"  {stage:<11} {rates}")
+    print(f"[+] Results written to {output_path}")
+
+    if args.compare:
+        print_comparison(report, args.compare)
+
+    print("--- Offline Benchmark Finished ---")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# benchmarks/stubs.py
+"""
+ベンチマーク用の軽量な代替実装。
+
+- スタブNLPモデル: 正規表現でカタカナ・漢字の連続を「未知語」として返す
+  (importすると解析器 "bench" として登録される。analyzer_service.py bench --module benchmarks.stubs でも使える)
+- スタブSupabaseクライアント: upsertされた行数を数えるだけで、外部には送信しない
+"""
+import re
+import time
+
+from process_common import register_analyzer
+
+_CANDIDATE_RE = re.compile(r'[゠-ヿ]{3,}|[一-鿿]{2,}')
+
+
+def load_stub_model():
+    """モデルのロードの代わりに、コンパイル済みの正規表現を返す"""
+    return _CANDIDATE_RE
+
+
+def process_batch_with_stub(sentences, nlp):
+    """process_batch_with_ginza と同じ形式で単語のリストを返す"""
+    discovered_words = []
+    for index, sentence in enumerate(sentences):
+        for match in nlp.finditer(sentence):
+            discovered_words.append({
+                "word": match.group(0),
+                "source_tool": "bench",
+                "pos_tag": "NOUN",
+                "sentence_index": index,
+            })
+    return discovered_words
+
+
+register_analyzer("bench", load_stub_model, process_batch_with_stub, display_name="Bench")
+
+
+class _StubQuery:
+    def __init__(self, client, table_name: str, rows: list):
+        self.client = client
+        self.table_name = table_name
+        self.rows = rows
+
+    def execute(self):
+        if self.client.latency_ms:
+            time.sleep(self.client.latency_ms / 1000.0)
+        self.client.rows_upserted[self.table_name] = self.client.rows_upserted.get(self.table_name, 0) + len(self.rows)
+        self.client.requests += 1
+        return self
+
+
+class _StubTable:
+    def __init__(self, client, table_name: str):
+        self.client = client
+        self.table_name = table_name
+
+    def upsert(self, rows, **kwargs):
+        return _StubQuery(self.client, self.table_name, rows)
+
+
+class StubSupabaseClient:
+    """supabase.Client のうち sync_to_supabase が使う table().upsert().execute() だけを実装する"""
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.rows_upserted = {}
+        self.requests = 0
+
+    def table(self, table_name: str):
+        return _StubTable(self, table_name)
@@ -1,73 +1,206 @@
 # build_dict_source.py
+"""
+Supabaseのユーザー辞書テーブルからSudachiのユーザー辞書ソース(CSV)を作成し、バイナリ辞書にコンパイルする。
+
+- 各テーブルは id によるキーセット・ページネーションで全件を取得し、1ページずつCSVに書き出す
+  (APIの最大行数で結果が黙って切り捨てられないようにする)
+- 書き出しと同時にSHA-256を計算し、内容が変わっていなければ既存のCSVには触れない
+- コンパイル済みの辞書は <CACHE_DIR>/user-<ハッシュ>.dic にキャッシュし、入力が同じなら再ビルドしない
+- 最新の辞書は <CACHE_DIR>/user.dic (シンボリックリンク) から参照でき、
+  preprocess.py は [Preprocessor] SUDACHI_USER_DICT でこれを読み込む
+
+    python build_dict_source.py
+    python build_dict_source.py --force   # キャッシュがあってもコンパイルし直す
+"""
 import os
+import sys
+import glob
+import shutil
+import hashlib
+import argparse
+import importlib
+import subprocess
 import configparser
+from importlib import metadata
 from supabase import create_client, Client
 
+DICTIONARY_TABLES = ["general_user_dictionary", "medical_user_dictionary"]
+SELECT_COLUMNS = "id, surface, sudachi_reading, reading, pos_master(pos1, pos2, pos3, pos4, pos5, pos6)"
+CURRENT_DICT_NAME = "user.dic"
+
+
+def iter_dictionary_rows(supabase: Client, table: str, page_size: int):
+    """idの昇順に1ページずつ取得して1行ずつ返す (OFFSETを使わないので後半のページも遅くならない)"""
+    last_id = None
+    while True:
+        query = supabase.from_(table).select(SELECT_COLUMNS)
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        response = query.order("id").limit(page_size).execute()
+        rows = response.data or []
+        yield from rows
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1]["id"]
+
+
+def to_csv_line(item: dict) -> str:
+    """完全版(18列)フォーマットのCSV行を生成する"""
+    surface = item['surface']
+    pos_data = item.get('pos_master') or {}
+    pos_parts = [pos_data.get(f'pos{i}') or '*' for i in range(1, 7)]
+    columns = [
+        surface,                   # 0: 見出し (TRIE 用)
+        '0',                       # 1: 左連接ID (安全なデフォルト値)
+        '0',                       # 2: 右連接ID (安全なデフォルト値)
+        '-1',                      # 3: コスト (自動計算)
+        item['sudachi_reading'],   # 4: 見出し (表示用)
+        *pos_parts,                # 5-10: 品詞 (6要素)
+        item['reading'],           # 11: 読み
+        surface,                   # 12: 正規化表記
+        '*',                       # 13: 辞書形ID
+        '*',                       # 14: 分割タイプ
+        '*',                       # 15: A単位分割情報
+        '*',                       # 16: B単位分割情報
+        '*'                        # 17: 未使用
+    ]
+    return ",".join(columns) + "\n"
+
+
+def file_sha256(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def export_source(supabase: Client, output_filename: str, page_size: int) -> str:
+    """
+    全テーブルをCSVに書き出し、その内容のSHA-256を返す。
+    内容が前回と同じなら既存ファイルを置き換えない。取得に失敗した場合は例外を送出し、既存ファイルは残す。
+    """
+    tmp_filename = output_filename + ".tmp"
+    hasher = hashlib.sha256()
+    total_words = 0
+    try:
+        with open(tmp_filename, 'w', encoding='utf-8', newline='') as f_out:
+            for table in DICTIONARY_TABLES:
+                print(f"  [*] テーブル '{table}' からデータを取得中...")
+                count = 0
+                for item in iter_dictionary_rows(supabase, table, page_size):
+                    line = to_csv_line(item)
+                    f_out.write(line)
+                    hasher.update(line.encode('utf-8'))
+                    count += 1
+                if count:
+                    print(f"    [+] {count}件の単語を追加しました。")
+                else:
+                    print(f"    [-] データがありません。")
+                total_words += count
+
+        source_hash = hasher.hexdigest()
+        if os.path.exists(output_filename) and file_sha256(output_filename) == source_hash:
+            print(f"[*] '{output_filename}' に変更はありません。")
+            os.remove(tmp_filename)
+        else:
+            os.replace(tmp_filename, output_filename)
+            print(f"[+] '{output_filename}' を更新しました。")
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+    print(f"[+] 合計 {total_words} 件の単語をCSVに出力しました。(sha256: {source_hash[:16]})")
+    return source_hash
+
+
+def system_dictionary_path(dict_type: str) -> str:
+    """インストール済みのSudachiDict-<dict_type>パッケージからsystem.dicのパスを求める"""
+    package = importlib.import_module(f"sudachidict_{dict_type}")
+    return os.path.join(os.path.dirname(package.__file__), "resources", "system.dic")
+
+
+def cache_key(source_hash: str, dict_type: str) -> str:
+    """ユーザー辞書はシステム辞書に依存するため、ソースのハッシュとシステム辞書・SudachiPyの版を合わせてキーにする"""
+    versions = []
+    for dist in (f"SudachiDict-{dict_type}", "SudachiPy"):
+        try:
+            versions.append(f"{dist}={metadata.version(dist)}")
+        except metadata.PackageNotFoundError:
+            versions.append(f"{dist}=unknown")
+    return hashlib.sha256("\n".join([source_hash, *versions]).encode('utf-8')).hexdigest()[:16]
+
+
+def compile_user_dictionary(source_filename: str, source_hash: str, dict_type: str, cache_dir: str,
+                            force: bool = False, keep: int = 3) -> str:
+    """sudachipy ubuildでコンパイルし、キャッシュ済みの辞書のパスを返す"""
+    os.makedirs(cache_dir, exist_ok=True)
+    key = cache_key(source_hash, dict_type)
+    cached_path = os.path.join(cache_dir, f"user-{key}.dic")
+
+    if os.path.exists(cached_path) and not force:
+        print(f"[*] 入力に変更がないため、キャッシュ済みの辞書を使います: {cached_path}")
+    else:
+        sudachipy_cli = shutil.which("sudachipy")
+        if not sudachipy_cli:
+            raise RuntimeError("sudachipy command was not found. Install sudachipy to compile the user dictionary.")
+        tmp_path = cached_path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        print(f"[*] ユーザー辞書をコンパイルしています (system: {dict_type})...")
+        subprocess.run([sudachipy_cli, "ubuild", "-s", system_dictionary_path(dict_type), "-o", tmp_path,
+                        "-d", f"mtc user dictionary {source_hash[:16]}", source_filename], check=True)
+        os.replace(tmp_path, cached_path)
+        print(f"[+] コンパイルしました: {cached_path}")
+
+    # 最新の辞書を固定の名前で参照できるようにする
+    current_path = os.path.join(cache_dir, CURRENT_DICT_NAME)
+    tmp_link = current_path + ".tmp"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(os.path.basename(cached_path), tmp_link)
+    os.replace(tmp_link, current_path)
+
+    # 古いキャッシュは新しいものから keep 個だけ残す
+    cached = sorted(glob.glob(os.path.join(cache_dir, "user-*.dic")), key=os.path.getmtime, reverse=True)
+    for old in cached[keep:]:
+        if old != cached_path:
+            os.remove(old)
+    return cached_path
+
+
 def main():
-    """Supabaseから全ユーザー辞書のデータを取得し、完全版(18列)フォーマットのCSVソースファイルを作成する"""
-    
+    """Supabaseから全ユーザー辞書のデータを取得し、完全版(18列)フォーマットのCSVソースとバイナリ辞書を作成する"""
+    parser = argparse.ArgumentParser(description="Export the user dictionary from Supabase and compile it for Sudachi.")
+    parser.add_argument('--force', action='store_true', help="Recompile even if a cached dictionary exists.")
+    parser.add_argument('--no-compile', action='store_true', help="Only export the CSV source.")
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    output_filename = config.get('Dictionary', 'SOURCE_CSV', fallback='user_dict_source.csv')
+    cache_dir = config.get('Dictionary', 'CACHE_DIR', fallback='.sudachi_cache')
+    page_size = config.getint('Dictionary', 'PAGE_SIZE', fallback=1000)
+    dict_type = config.get('Preprocessor', 'SUDACHI_DICT_TYPE', fallback='full')
+
     supabase_url: str = os.environ.get("SUPABASE_URL")
     supabase_key: str = os.environ.get("SUPABASE_KEY")
-    if not supabase_url or not supabase_key: 
+    if not supabase_url or not supabase_key:
         raise ValueError("環境変数を設定してください。")
 
     supabase = create_client(supabase_url, supabase_key)
-    
-    dictionary_tables = ["general_user_dictionary", "medical_user_dictionary"]
-    output_filename = "user_dict_source.csv"
-    
+
     print(f"[*] ユーザー辞書ソースを '{output_filename}' に生成します...")
-    
-    total_words = 0
-    with open(output_filename, 'w', encoding='utf-8') as f_out:
-        for table in dictionary_tables:
-            print(f"  [*] テーブル '{table}' からデータを取得中...")
-            try:
-                # pos_masterテーブルをJOINして、品詞文字列を取得
-                response = supabase.from_(table).select(
-                    "surface, sudachi_reading, reading, pos_master(pos1, pos2, pos3, pos4, pos5, pos6)"
-                ).execute()
-                
-                if not response.data:
-                    print(f"    [-] データがありません。")
-                    continue
-                
-                for item in response.data:
-                    surface = item['surface']
-                    sudachi_reading = item['sudachi_reading']
-                    reading = item['reading']
-                    
-                    pos_data = item.get('pos_master', {})
-                    pos_parts = [
-                        pos_data.get(f'pos{i}', '*') for i in range(1, 7)
-                    ]
-                    
-                    # 完全版(18列)フォーマットのCSV行を生成
-                    columns = [
-                        surface,           # 0: 見出し (TRIE 用)
-                        '0',               # 1: 左連接ID (安全なデフォルト値)
-                        '0',               # 2: 右連接ID (安全なデフォルト値)
-                        '-1',              # 3: コスト (自動計算)
-                        sudachi_reading,   # 4: 見出し (表示用)
-                        *pos_parts,        # 5-10: 品詞 (6要素)
-                        reading,           # 11: 読み
-                        surface,           # 12: 正規化表記
-                        '*',               # 13: 辞書形ID
-                        '*',               # 14: 分割タイプ
-                        '*',               # 15: A単位分割情報
-                        '*',               # 16: B単位分割情報
-                        '*'                # 17: 未使用
-                    ]
-                    
-                    line = ",".join(columns) + "\n"
-                    f_out.write(line)
-                
-                print(f"    [+] {len(response.data)}件の単語を追加しました。")
-                total_words += len(response.data)
-            except Exception as e:
-                print(f"    [!!!] テーブル '{table}' の処理中にエラー: {e}")
+    try:
+        source_hash = export_source(supabase, output_filename, page_size)
+    except Exception as e:
+        print(f"    [!!!] ユーザー辞書の取得中にエラー: {e}", file=sys.stderr)
+        sys.exit(1)
 
-    print(f"\n[+] 合計 {total_words} 件の単語をCSVに出力しました。")
+    if os.path.getsize(output_filename) == 0:
+        print("[-] 単語が1件もないため、ユーザー辞書はコンパイルしません。")
+    elif not args.no_compile:
+        compile_user_dictionary(output_filename, source_hash, dict_type, cache_dir, force=args.force)
 
 if __name__ == "__main__":
     main()
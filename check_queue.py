@@ -1,10 +1,18 @@
 # check_queue.py
 import os
 from supabase import create_client, Client
+from analyzers import ANALYZER_MODULES
+
+def count_pending(supabase: Client, analyzer: str) -> int:
+    res = supabase.table("analysis_batches").select("last_sentence_id").eq("analyzer", analyzer) \
+        .order("last_sentence_id", desc=True).limit(1).execute()
+    watermark = res.data[0]["last_sentence_id"] if res and res.data else 0
+    pending = supabase.table("sentence_queue").select("id", count='exact').gt("id", watermark).limit(1).execute()
+    return pending.count if pending else 0
 
 def main():
     """
-    sentence_queueテーブルを調べ、GiNZAとStanzaが処理すべき
+    sentence_queueとanalysis_batchesを調べ、各解析器が処理すべき
     それぞれの件数を数えて、GitHub Actionsの出力として設定する。
     """
     supabase_url: str = os.environ.get("SUPABASE_URL")
@@ -14,21 +22,17 @@ def main():
 
     supabase = create_client(supabase_url, supabase_key)
     
-    # GiNZAの未処理件数をカウント
-    ginza_res = supabase.table("sentence_queue").select("id", count='exact').eq("ginza_status", "queued").execute()
-    ginza_count = ginza_res.count if ginza_res else 0
-    print(f"Sentences to process for GiNZA: {ginza_count}")
-
-    # Stanzaの未処理件数をカウント
-    stanza_res = supabase.table("sentence_queue").select("id", count='exact').eq("stanza_status", "queued").execute()
-    stanza_count = stanza_res.count if stanza_res else 0
-    print(f"Sentences to process for Stanza: {stanza_count}")
+    # 解析器ごとの未処理件数 = analysis_batchesのウォーターマークより後ろの文の数
+    counts = {}
+    for analyzer in ANALYZER_MODULES:
+        counts[analyzer] = count_pending(supabase, analyzer)
+        print(f"Sentences to process for {analyzer}: {counts[analyzer]}")
 
     # GitHub Actionsの次のステップで使えるように、結果を出力変数に設定
     if 'GITHUB_OUTPUT' in os.environ:
         with open(os.environ['GITHUB_OUTPUT'], 'a') as f:
-            print(f'ginza_count={ginza_count}', file=f)
-            print(f'stanza_count={stanza_count}', file=f)
+            for analyzer, count in counts.items():
+                print(f'{analyzer}_count={count}', file=f)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,21 +1,26 @@
 # db_utils.py
 import os
 import configparser
-from sqlalchemy import create_engine, Column, BigInteger, Text, TIMESTAMP, Enum
+from typing import TYPE_CHECKING
+from sqlalchemy import create_engine, text, Column, BigInteger, Integer, Float, Text, TIMESTAMP, Enum, UniqueConstraint, Index
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
-from supabase import create_client, Client
+
+if TYPE_CHECKING:
+    from supabase import Client
 
 # --- Supabase Client ---
 _supabase_client = None
 
-def get_supabase_client() -> Client:
+def get_supabase_client() -> "Client":
     """
     環境変数から接続情報を直接読み取り、Supabaseクライアントを返す
+    (supabaseは読み込みが重いため、ローカルDBだけを使う処理では読み込まない)
     """
     global _supabase_client
     if _supabase_client is None:
+        from supabase import create_client
         # --- 修正点: config.iniからではなく、os.environから直接読み込む ---
         url = os.environ.get("SUPABASE_URL")
         key = os.environ.get("SUPABASE_KEY")
@@ -44,6 +49,35 @@ def get_local_db_session():
         _local_session_factory = sessionmaker(bind=engine)
     return _local_session_factory()
 
+def _reset_local_session_factory():
+    # fork後の子プロセス(ProcessPoolExecutorのワーカー)が親のコネクションプールを共有しないよう、
+    # 子プロセス側では新しいエンジンを作り直させる
+    global _local_session_factory
+    _local_session_factory = None
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_local_session_factory)
+
+def lock_sentence_inserts(session, exclusive: bool = False):
+    """
+    sentence_queueへの挿入とanalysis_batchesの取得を排他するトランザクション単位のアドバイザリロック。
+    preprocessは文を挿入する前に共有ロックを、process_common.claim_batchは排他ロックを取る。
+    挿入中のトランザクションは連番のidを先に確保してから順不同にコミットするため、
+    排他ロックを持っている間だけは、見えている最大のidより小さい文が後からコミットされることがない。
+    """
+    function = "pg_advisory_xact_lock" if exclusive else "pg_advisory_xact_lock_shared"
+    session.execute(text(f"SELECT {function}(hashtext('sentence_queue:insert'))"))
+
+def lock_occurrence_writes(session, exclusive: bool = False):
+    """
+    word_occurrencesの書き込み (と、preprocessによる出典URLの行の削除) と、score_terms.pyの読み込み位置の決定を排他する。
+    書き込む側は共有ロックを取ってから、サーバーの時刻 (clock_timestamp()) をupdated_at / processed_atに入れる。
+    score_terms.pyは排他ロックを取った時点の時刻を読み込みの上限にするため、
+    上限より前の時刻を持つ行が後からコミットされることがない。
+    """
+    function = "pg_advisory_xact_lock" if exclusive else "pg_advisory_xact_lock_shared"
+    session.execute(text(f"SELECT {function}(hashtext('word_occurrences:write'))"))
+
 # --- ORM Model Classes ---
 ProcessStatusEnum = Enum('queued', 'processing', 'completed', 'failed', name='process_status_enum')
 
@@ -62,8 +96,28 @@ class SentenceQueue(Base):
     id = Column(BigInteger, primary_key=True)
     crawl_queue_id = Column(BigInteger, nullable=False)
     sentence_text = Column(Text, nullable=False)
-    ginza_status = Column(ProcessStatusEnum, nullable=False, default='queued')
-    stanza_status = Column(ProcessStatusEnum, nullable=False, default='queued')
+
+class AnalysisBatch(Base):
+    """
+    解析器(GiNZA/Stanzaなど)ごとの処理済み範囲。1バッチ = sentence_queueのidの連続した範囲。
+    解析器ごとの最大のlast_sentence_idより後ろの文が未処理となるため、sentence_queueの行は更新しない。
+    (範囲の途中に後から文がコミットされないよう、取得時は lock_sentence_inserts で挿入と排他する)
+    解析器を追加してもスキーマの変更は不要。
+    """
+    __tablename__ = 'analysis_batches'
+    __table_args__ = (
+        # 同じ範囲を2つのワーカーが取得しないための制約
+        UniqueConstraint('analyzer', 'first_sentence_id', name='unique_batch_per_analyzer'),
+        Index('ix_analysis_batches_analyzer_last', 'analyzer', 'last_sentence_id'),
+    )
+    id = Column(BigInteger, primary_key=True)
+    analyzer = Column(Text, nullable=False)
+    first_sentence_id = Column(BigInteger, nullable=False)
+    last_sentence_id = Column(BigInteger, nullable=False)
+    sentence_count = Column(Integer, nullable=False)
+    status = Column(ProcessStatusEnum, nullable=False, default='processing')
+    claimed_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+    completed_at = Column(TIMESTAMP(timezone=True))
 
 class StopWord(Base):
     __tablename__ = 'stop_words'
@@ -85,6 +139,8 @@ class BoilerplatePattern(Base):
 
 class UniqueWord(Base):
     __tablename__ = 'unique_words'
+    # process_commonのon_conflict_do_nothing(index_elements=['word', 'source_tool'])が前提とする制約
+    __table_args__ = (UniqueConstraint('word', 'source_tool', name='unique_word_per_tool'),)
     id = Column(BigInteger, primary_key=True)
     word = Column(Text, nullable=False)
     source_tool = Column(Text, nullable=False)
@@ -94,6 +150,24 @@ class UniqueWord(Base):
 
 class WordOccurrence(Base):
     __tablename__ = 'word_occurrences'
+    # process_common.save_discovered_wordsのon_conflict_do_update(index_elements=['word_id', 'source_url'])が前提とする制約
+    __table_args__ = (UniqueConstraint('word_id', 'source_url', name='unique_occurrence'),)
     id = Column(BigInteger, primary_key=True)
     word_id = Column(BigInteger, nullable=False) # FK制約はモデル上では省略
     source_url = Column(Text, nullable=False)
+    occurrence_count = Column(Integer, nullable=False, default=1)
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+
+class TermScore(Base):
+    """score_terms.pyが計算する語ごとのスコア (GiNZA/Stanzaの結果を表記でまとめたもの)"""
+    __tablename__ = 'term_scores'
+    word = Column(Text, primary_key=True)
+    document_frequency = Column(Integer, nullable=False)
+    total_count = Column(BigInteger, nullable=False)
+    tfidf = Column(Float, nullable=False)
+    c_value = Column(Float, nullable=False)
+    tool_count = Column(Integer, nullable=False)
+    tool_agreement = Column(Float, nullable=False)
+    # レビューではscoreの降順に並べて使う
+    score = Column(Float, nullable=False, index=True)
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
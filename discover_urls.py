@@ -6,16 +6,15 @@ import configparser
 import threading
 import time
 import random
+import argparse
 from urllib.parse import urljoin, urlparse
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from bs4 import BeautifulSoup
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 from url_normalize import url_normalize
-import warnings
-from bs4 import XMLParsedAsHTMLWarning
-
-warnings.filterwarnings('ignore', category=XMLParsedAsHTMLWarning)
+from html_parsing import extract_links
+from fetch_utils import create_http_session, fetch_html, fetch_html_adaptive, DEFAULT_MAX_RESPONSE_BYTES, DEFAULT_CHUNK_SIZE
+from adaptive_concurrency import controller_from_config
+from warc_archive import open_recorder
+import metrics
 
 # SQLAlchemy関連のインポート
 from sqlalchemy.dialects.postgresql import insert
@@ -26,28 +25,40 @@ urls_to_visit = set()
 visited_urls = set()
 lock = threading.Lock()
 
-def worker_fetch_links(url: str, config, session) -> set:
+def worker_fetch_links(url: str, config, session, warc_recorder=None, controller=None) -> set:
     """
     Fetches a single URL, parses it for new links, normalizes them, and returns them as a set.
+    With a controller, the request waits for a concurrency slot instead of sleeping for a fixed delay
+    (REQUEST_DELAY_SECONDS still applies as the minimum gap once the controller is at its lower limit).
     """
     target_domain = config.get('General', 'TARGET_DOMAIN')
     request_timeout = config.getint('General', 'REQUEST_TIMEOUT')
     request_delay = config.getfloat('General', 'REQUEST_DELAY_SECONDS', fallback=0.5)
+    html_backend = config.get('General', 'HTML_PARSER', fallback='lxml')
+    max_response_bytes = config.getint('General', 'MAX_RESPONSE_BYTES', fallback=DEFAULT_MAX_RESPONSE_BYTES)
+    fetch_chunk_size = config.getint('General', 'FETCH_CHUNK_SIZE', fallback=DEFAULT_CHUNK_SIZE)
+    max_attempts = config.getint('Concurrency', 'MAX_ATTEMPTS', fallback=3)
+    retry_backoff = config.getfloat('Concurrency', 'RETRY_BACKOFF_SECONDS', fallback=1.0)
     
     found_links = set()
     try:
-        time.sleep(random.uniform(request_delay * 0.5, request_delay * 1.5))
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        response = session.get(url, timeout=request_timeout, headers=headers, allow_redirects=True)
-        response.raise_for_status()
-        
-        content_type = response.headers.get("content-type", "").lower()
+        if controller:
+            fetched = fetch_html_adaptive(controller, session, url, request_timeout, max_response_bytes,
+                                          fetch_chunk_size, max_attempts, retry_backoff)
+        else:
+            time.sleep(random.uniform(request_delay * 0.5, request_delay * 1.5))
+            fetched = fetch_html(session, url, request_timeout, max_response_bytes, fetch_chunk_size)
+
+        if fetched.status == "ok" and warc_recorder:
+            warc_recorder.write_response(fetched, request_url=url)
 
-        if "html" in content_type:
-            soup = BeautifulSoup(response.content, 'html5lib')
-            for a_tag in soup.find_all('a', href=True):
+        if fetched.status == "ok":
+            with metrics.timer("parse.links_ms"):
+                hrefs = extract_links(fetched.content, backend=html_backend, encoding=fetched.encoding)
+            metrics.incr("discover.links_seen", len(hrefs))
+            for href in hrefs:
                 try:
-                    link = urljoin(url, a_tag['href'])
+                    link = urljoin(fetched.url, href)
                     normalized_link = url_normalize(link)
                     
                     if urlparse(normalized_link).netloc == target_domain:
@@ -60,6 +71,7 @@ def worker_fetch_links(url: str, config, session) -> set:
     except Exception as e:
         print(f"  [!] Unknown Error in worker: {url} - {e}", file=sys.stderr)
     
+    metrics.incr("discover.pages")
     return found_links
 
 def main():
@@ -67,6 +79,10 @@ def main():
     Main orchestrator for multi-level, parallel URL discovery.
     """
     global urls_to_visit, visited_urls
+
+    parser = argparse.ArgumentParser(description="Discover URLs under the target domain.")
+    parser.add_argument('--warc-dir', help="Save fetched HTML responses as gzipped WARC files in this directory.")
+    args = parser.parse_args()
     
     config = configparser.ConfigParser()
     config.read('config.ini')
@@ -79,11 +95,20 @@ def main():
     db_session = get_local_db_session()
     
     print(f"--- URL Discovery Started (Depth: {crawl_depth}) ---")
+    metrics.start("discover", config)
 
-    session = requests.Session()
-    retries = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
-    session.mount('https://', HTTPAdapter(max_retries=retries))
-    session.mount('http://', HTTPAdapter(max_retries=retries))
+    # ADAPTIVEが有効なら、スレッドはMAX_CONCURRENCYまで用意し、実際の同時リクエスト数はコントローラーが決める
+    controller = controller_from_config(config, name="discover.concurrency")
+    if controller:
+        max_workers = controller.max_limit
+        session = create_http_session(pool_size=max_workers, retry_statuses=())
+        print(f"[*] Adaptive concurrency: starting at {controller.limit}, up to {controller.max_limit}.")
+    else:
+        session = create_http_session(pool_size=max_workers)
+    warc_dir = args.warc_dir or config.get('Archive', 'WARC_DIR', fallback='').strip()
+    warc_recorder = open_recorder(warc_dir, 'discover')
+    if warc_recorder:
+        print(f"[*] Fetched responses will be archived to '{warc_recorder.path}'.")
     
     urls_to_visit.update(index_pages)
     all_discovered_links = set()
@@ -106,7 +131,7 @@ def main():
         all_discovered_links.update(current_batch)
         
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_url = {executor.submit(worker_fetch_links, url, config, session): url for url in current_batch}
+            future_to_url = {executor.submit(worker_fetch_links, url, config, session, warc_recorder, controller): url for url in current_batch}
             
             for future in as_completed(future_to_url):
                 try:
@@ -116,9 +141,16 @@ def main():
                 except Exception as exc:
                     print(f'[!] An exception occurred in a worker future: {exc}', file=sys.stderr)
 
+    if warc_recorder:
+        warc_recorder.close()
+        print(f"[*] Archived {warc_recorder.records_written} responses.")
+    if controller:
+        print(f"[*] Final concurrency limit: {controller.limit}")
+
     if not all_discovered_links:
         print("[*] No URLs were discovered.")
         db_session.close()
+        metrics.finish()
         return
 
     print(f"\n[*] Discovered {len(all_discovered_links)} total unique URLs. Upserting to local queue...")
@@ -127,10 +159,14 @@ def main():
         links_list = [{"url": link} for link in all_discovered_links]
         for i in range(0, len(links_list), db_write_batch_size):
             chunk = links_list[i:i + db_write_batch_size]
-            stmt = insert(CrawlQueue).values(chunk).on_conflict_do_nothing(index_elements=['url'])
-            db_session.execute(stmt)
+            # ON CONFLICT DO NOTHINGのrowcountはドライバによって-1になるため、RETURNINGで挿入行を数える
+            stmt = insert(CrawlQueue).values(chunk).on_conflict_do_nothing(index_elements=['url']).returning(CrawlQueue.id)
+            with metrics.timer("db.upsert_ms"):
+                inserted = len(db_session.execute(stmt).all())
+            metrics.incr("db.rows_written", inserted)
         
-        db_session.commit()
+        with metrics.timer("db.commit_ms"):
+            db_session.commit()
         print("  [+] Upserted links to local crawl_queue.")
     except Exception as e:
         print(f"  [!] DB Error during final upsert: {e}", file=sys.stderr)
@@ -138,6 +174,7 @@ def main():
     finally:
         db_session.close()
 
+    metrics.finish()
     print(f"\n--- URL Discovery Finished ---")
 
 if __name__ == "__main__":
@@ -0,0 +1,94 @@
+# encoding_utils.py
+"""
+HTMLの文字コード判定。
+
+BOM → Content-Typeヘッダー → <meta charset>/<?xml encoding> → strictデコード → chardet の順で判定する。
+fetch_utils (HTTP取得) と html_parsing (WARCのリプレイやベンチマークでも使う) の両方から使うため、
+標準ライブラリ以外には依存しない (chardetは最後の手段としてのみ遅延importする)。
+"""
+import re
+import codecs
+
+_BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+_HEADER_CHARSET_RE = re.compile(r'charset\s*=\s*["\']?\s*([a-zA-Z0-9_\-:.]+)', re.IGNORECASE)
+_META_CHARSET_RE = re.compile(
+    rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-zA-Z0-9_\-:.]+)'
+    rb'|<\?xml[^>]+encoding\s*=\s*["\']([a-zA-Z0-9_\-:.]+)',
+    re.IGNORECASE,
+)
+# 厚労省の古いページで使われる文字コードを、実際の文字集合に合わせて読み替える
+_ENCODING_ALIASES = {
+    'shift_jis': 'cp932', 'shift-jis': 'cp932', 'sjis': 'cp932', 'x-sjis': 'cp932',
+    'ms_kanji': 'cp932', 'windows-31j': 'cp932', 'csshiftjis': 'cp932',
+    'euc-jp': 'euc_jp', 'x-euc-jp': 'euc_jp',
+    'iso-2022-jp': 'iso2022_jp',
+}
+# EUC-JPには現れず、Shift_JIS(cp932)の2バイト文字の先頭には頻出するバイト
+_SJIS_ONLY_LEAD_RE = re.compile(rb'[\x81-\x8d\x90-\x9f]')
+_SNIFF_BYTES = 4096
+_DETECT_BYTES = 64 * 1024
+
+
+def normalize_encoding(name: str):
+    """文字コード名をPythonのコーデック名に揃える。不明な場合はNone"""
+    if not name:
+        return None
+    name = name.strip().strip('"\'').lower()
+    name = _ENCODING_ALIASES.get(name, name)
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+
+def _fast_detect(content: bytes):
+    sample = content[:_DETECT_BYTES]
+    # 途中で切ったマルチバイト文字でstrictデコードが失敗しないよう末尾を少し削る
+    if len(content) > _DETECT_BYTES:
+        sample = sample[:-4]
+    if _SJIS_ONLY_LEAD_RE.search(sample):
+        candidates = ('utf-8', 'cp932')
+    else:
+        candidates = ('utf-8', 'euc_jp', 'cp932')
+    for candidate in candidates:
+        try:
+            sample.decode(candidate)
+            return candidate
+        except UnicodeDecodeError:
+            continue
+    return None
+
+
+def detect_encoding(content: bytes, content_type: str = None) -> str:
+    """
+    BOM → Content-Typeヘッダー → <meta charset>/<?xml encoding> → strictデコード → chardet
+    の順で文字コードを判定する。
+    """
+    for bom, encoding in _BOMS:
+        if content.startswith(bom):
+            return encoding
+
+    if content_type:
+        match = _HEADER_CHARSET_RE.search(content_type)
+        encoding = normalize_encoding(match.group(1)) if match else None
+        if encoding:
+            return encoding
+
+    match = _META_CHARSET_RE.search(content[:_SNIFF_BYTES])
+    if match:
+        declared = (match.group(1) or match.group(2)).decode('ascii', 'ignore')
+        encoding = normalize_encoding(declared)
+        if encoding:
+            return encoding
+
+    encoding = _fast_detect(content)
+    if encoding:
+        return encoding
+
+    import chardet
+    guess = chardet.detect(content[:_DETECT_BYTES])
+    return normalize_encoding(guess.get('encoding')) or 'utf-8'
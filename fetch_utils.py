@@ -0,0 +1,184 @@
+# fetch_utils.py
+"""
+discover_urls / preprocess で共通のHTTP取得レイヤー。
+
+レスポンス本文をストリーミングで読み込み、
+- 上限サイズ(MAX_RESPONSE_BYTES)を超えたら途中で打ち切る
+- 先頭チャンクでバイナリ(PDF/Office/画像など)と判定したら打ち切る
+- 読み込みと同時にSHA-256を計算する
+- BOM → ヘッダー → <meta> → 高速判定 → chardet の順で文字コードを決める (encoding_utils)
+"""
+import codecs
+import hashlib
+import time
+from typing import NamedTuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+from encoding_utils import detect_encoding
+from adaptive_concurrency import OVERLOAD_STATUSES, parse_retry_after, retry_delay
+
+DEFAULT_HEADERS = {'User-Agent': 'Mozilla/5.0'}
+DEFAULT_MAX_RESPONSE_BYTES = 10 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_RETRY_STATUSES = (500, 502, 503, 504)
+
+# 先頭バイトで判別できる代表的なバイナリ形式
+_BINARY_MAGIC = (
+    b'%PDF-',                 # PDF
+    b'PK\x03\x04',            # docx/xlsx/pptx/zip
+    b'\xd0\xcf\x11\xe0',      # doc/xls/ppt (OLE2)
+    b'\x89PNG', b'\xff\xd8\xff', b'GIF8',
+)
+
+
+class FetchResult(NamedTuple):
+    url: str
+    status_code: int
+    status: str  # 'ok' / 'non_html' / 'too_large' / 'binary'
+    content: bytes
+    encoding: str
+    content_hash: str
+    content_type: str
+    headers: dict
+    elapsed: float
+    latency: float  # 応答ヘッダーを受け取るまでの秒数 (本文のサイズに左右されないサーバー負荷の指標)
+
+
+def create_http_session(pool_size: int = 10, retry_statuses=DEFAULT_RETRY_STATUSES) -> requests.Session:
+    """
+    リトライ付きのrequests.Sessionを作成する。
+    AdaptiveConcurrencyで制御する場合は retry_statuses=() とし、429/5xxをコントローラーに見せる。
+    """
+    session = requests.Session()
+    # urllib3はstatus_forcelistが空でも429/503のRetry-Afterを待って再試行するため、その場合は無効にする
+    retries = Retry(total=3, backoff_factor=1, status_forcelist=list(retry_statuses),
+                    respect_retry_after_header=bool(retry_statuses))
+    adapter = HTTPAdapter(max_retries=retries, pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def looks_binary(head: bytes) -> bool:
+    """先頭チャンクからバイナリかどうかを判定する"""
+    if head.startswith(_BINARY_MAGIC):
+        return True
+    # UTF-16のBOMがあればNULを含んでもテキスト
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return False
+    return b'\x00' in head[:1024]
+
+
+def fetch_html(session: requests.Session, url: str, timeout: int,
+               max_bytes: int = DEFAULT_MAX_RESPONSE_BYTES,
+               chunk_size: int = DEFAULT_CHUNK_SIZE,
+               headers: dict = None) -> FetchResult:
+    """
+    URLをストリーミングで取得する。HTML以外・上限超過・バイナリの場合は本文を読み切らずに返す。
+    HTTPエラーはrequests.exceptions.HTTPErrorとして送出する。
+    """
+    start = time.perf_counter()
+    metrics.incr("http.requests")
+    try:
+        response = session.get(url, timeout=timeout, headers=headers or DEFAULT_HEADERS,
+                               allow_redirects=True, stream=True)
+    except requests.exceptions.RequestException:
+        metrics.incr("http.errors")
+        raise
+    try:
+        metrics.incr(f"http.status.{response.status_code}")
+        response.raise_for_status()
+        content_type = response.headers.get("content-type", "").lower()
+
+        def result(status, content=b"", encoding=None, content_hash=None):
+            elapsed = time.perf_counter() - start
+            metrics.incr(f"http.result.{status}")
+            metrics.incr("http.bytes", len(content))
+            metrics.observe("http.fetch_ms", elapsed * 1000.0)
+            return FetchResult(response.url, response.status_code, status, content, encoding,
+                               content_hash, content_type, dict(response.headers), elapsed,
+                               response.elapsed.total_seconds())
+
+        if "html" not in content_type:
+            return result("non_html")
+
+        declared_length = response.headers.get("content-length", "")
+        if declared_length.isdigit() and int(declared_length) > max_bytes:
+            return result("too_large")
+
+        hasher = hashlib.sha256()
+        chunks = []
+        total = 0
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if not chunk:
+                continue
+            if total == 0 and looks_binary(chunk):
+                return result("binary")
+            total += len(chunk)
+            if total > max_bytes:
+                return result("too_large")
+            hasher.update(chunk)
+            chunks.append(chunk)
+
+        content = b"".join(chunks)
+        with metrics.timer("http.charset_ms"):
+            encoding = detect_encoding(content, content_type)
+        return result("ok", content, encoding, hasher.hexdigest())
+    finally:
+        response.close()
+
+
+def fetch_outcome(fetched: FetchResult = None, error: Exception = None) -> dict:
+    """取得結果をAdaptiveConcurrency.release()に渡す引数に変換する"""
+    if fetched is not None:
+        return {"latency": fetched.latency, "status_code": fetched.status_code}
+    response = getattr(error, "response", None)
+    if response is None:
+        # 接続エラー・タイムアウト
+        return {"error": True}
+    retry_after = None
+    if response.status_code in OVERLOAD_STATUSES:
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+    return {"latency": response.elapsed.total_seconds(), "status_code": response.status_code,
+            "retry_after": retry_after}
+
+
+def is_retryable(error: Exception) -> bool:
+    """サーバー側の混雑が原因で、時間をおけば成功しそうなエラーかどうか"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+    return response.status_code in OVERLOAD_STATUSES
+
+
+def fetch_html_adaptive(controller, session: requests.Session, url: str, timeout: int,
+                        max_bytes: int = DEFAULT_MAX_RESPONSE_BYTES,
+                        chunk_size: int = DEFAULT_CHUNK_SIZE,
+                        max_attempts: int = 3, retry_backoff: float = 1.0) -> FetchResult:
+    """
+    AdaptiveConcurrencyのスロット内でfetch_htmlを呼ぶ。
+    429/5xx・接続エラーは結果をコントローラーに渡したうえで再試行する。
+    Retry-Afterがあればコントローラーがその時刻まで次のスロットを渡さず、
+    なければスロットの外で retry_delay() の秒数だけ待ってから再試行する。
+    """
+    for attempt in range(1, max_attempts + 1):
+        with controller.slot() as outcome:
+            try:
+                fetched = fetch_html(session, url, timeout, max_bytes, chunk_size)
+            except requests.exceptions.RequestException as e:
+                result = fetch_outcome(error=e)
+                outcome.record(**result)
+                if attempt >= max_attempts or not is_retryable(e):
+                    raise
+            else:
+                outcome.record(**fetch_outcome(fetched))
+                return fetched
+        metrics.incr("http.retries")
+        if result.get("retry_after") is None:
+            delay = retry_delay(attempt, retry_backoff)
+            metrics.observe("http.retry_backoff_ms", delay * 1000.0)
+            time.sleep(delay)
@@ -0,0 +1,169 @@
+# html_parsing.py
+"""
+HTMLの解析バックエンドを切り替え可能にする共通レイヤー。
+
+- lxml       : C実装(libxml2)のパーサーにtargetを渡し、ツリーを構築せずにイベントだけを受け取る (既定)
+- html.parser: 標準ライブラリのストリーミングパーサー (lxmlが無い環境用)
+- html5lib   : 従来のBeautifulSoup(html5lib)実装 (比較・ベンチマーク用)
+"""
+import sys
+from html.parser import HTMLParser as _StdlibHTMLParser
+
+from encoding_utils import detect_encoding, normalize_encoding
+
+try:
+    from lxml import etree as _lxml_etree
+except ImportError:
+    _lxml_etree = None
+
+# 本文抽出時に中身ごと捨てる要素 (従来のdecompose対象と同じ)
+SKIP_TEXT_TAGS = frozenset(["script", "style", "header", "footer", "nav", "aside", "form"])
+
+DEFAULT_BACKEND = "lxml"
+BACKENDS = ("lxml", "html.parser", "html5lib")
+
+
+def resolve_backend(name: str = None) -> str:
+    """
+    設定値からバックエンド名を決定する。lxmlが未インストールの場合はhtml.parserに落とす。
+    """
+    name = (name or DEFAULT_BACKEND).strip().lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown HTML parser backend: {name} (choose from {', '.join(BACKENDS)})")
+    if name == "lxml" and _lxml_etree is None:
+        print("   [!] lxml is not installed. Falling back to 'html.parser'.", file=sys.stderr)
+        return "html.parser"
+    return name
+
+
+def _decode(content: bytes, encoding: str = None) -> str:
+    """html.parser用: 文字コードの指定がなければ判定してからデコードする"""
+    if isinstance(content, str):
+        return content
+    return content.decode(normalize_encoding(encoding) or detect_encoding(content), "replace")
+
+
+# --- Event handlers (shared by lxml target and stdlib parser) ---
+class _LinkCollector:
+    """<a href>の値だけを集める。ツリーは構築しない。"""
+    def __init__(self):
+        self.links = []
+
+    def start(self, tag, attrib):
+        if tag == "a":
+            href = attrib.get("href")
+            if href is not None:
+                self.links.append(href)
+
+    def end(self, tag):
+        pass
+
+    def data(self, data):
+        pass
+
+    def close(self):
+        return self.links
+
+
+class _TextCollector:
+    """
+    SKIP_TEXT_TAGSの内側を無視しながらテキストノードを集める。
+    BeautifulSoup.get_text(separator="\\n", strip=True) と同じ形式で返す。
+    """
+    def __init__(self):
+        self.parts = []
+        self._buffer = []
+        self._skip_depth = 0
+
+    def _flush(self):
+        if self._buffer:
+            text = "".join(self._buffer).strip()
+            if text:
+                self.parts.append(text)
+            self._buffer = []
+
+    def start(self, tag, attrib):
+        self._flush()
+        if tag in SKIP_TEXT_TAGS:
+            self._skip_depth += 1
+
+    def end(self, tag):
+        self._flush()
+        if tag in SKIP_TEXT_TAGS and self._skip_depth > 0:
+            self._skip_depth -= 1
+
+    def data(self, data):
+        if self._skip_depth == 0:
+            self._buffer.append(data)
+
+    def close(self):
+        self._flush()
+        return "\n".join(self.parts)
+
+
+class _StdlibAdapter(_StdlibHTMLParser):
+    """標準ライブラリのHTMLParserのイベントをcollectorへ中継する"""
+    def __init__(self, collector):
+        super().__init__(convert_charrefs=True)
+        self.collector = collector
+
+    def handle_starttag(self, tag, attrs):
+        self.collector.start(tag, {k: (v if v is not None else "") for k, v in attrs})
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        self.collector.end(tag)
+
+    def handle_endtag(self, tag):
+        self.collector.end(tag)
+
+    def handle_data(self, data):
+        self.collector.data(data)
+
+
+def _run_collector(collector, content, encoding: str, backend: str):
+    if backend == "lxml":
+        if isinstance(content, str) or encoding:
+            # libxml2はPythonのコーデック名を解釈できないため、文字コードが確定している場合は
+            # こちらでデコードしてUTF-8に揃える (<meta charset>の宣言も無視させる)
+            content, encoding = _decode(content, encoding).encode("utf-8"), "utf-8"
+        parser = _lxml_etree.HTMLParser(target=collector, encoding=encoding)
+        parser.feed(content)
+        return parser.close()
+
+    adapter = _StdlibAdapter(collector)
+    adapter.feed(_decode(content, encoding))
+    adapter.close()
+    return collector.close()
+
+
+def _soup(content, encoding: str = None):
+    from bs4 import BeautifulSoup
+    if encoding:
+        # html5lib(webencodings)はcp932などのコーデック名を解釈できないため、先にデコードする
+        content = _decode(content, encoding)
+    return BeautifulSoup(content, "html5lib")
+
+
+# --- Public API ---
+def extract_links(content, backend: str = None, encoding: str = None) -> list:
+    """
+    HTML中の<a href>の値を文書順で返す (相対URLの解決は呼び出し側で行う)。
+    """
+    backend = resolve_backend(backend)
+    if backend == "html5lib":
+        return [a["href"] for a in _soup(content, encoding).find_all("a", href=True)]
+    return _run_collector(_LinkCollector(), content, encoding, backend)
+
+
+def extract_main_text(content, backend: str = None, encoding: str = None) -> str:
+    """
+    script/style/header/footer/nav/aside/formを除いた本文テキストを改行区切りで返す。
+    """
+    backend = resolve_backend(backend)
+    if backend == "html5lib":
+        soup = _soup(content, encoding)
+        for s in soup(list(SKIP_TEXT_TAGS)):
+            s.decompose()
+        return soup.get_text(separator="\n", strip=True)
+    return _run_collector(_TextCollector(), content, encoding, backend)
@@ -0,0 +1,289 @@
+# metrics.py
+"""
+パイプライン全体で共有する軽量なメトリクス収集レイヤー。
+
+- incr()    : カウンター (HTTPステータス、バイト数、書き込み行数など)
+- observe() : ヒストグラム (解析ms、推論ms、コミットmsなど)
+- timer()   : with文で囲んだ区間の経過msをヒストグラムに記録する
+
+start()を呼ぶと、一定間隔でスナップショットをJSON Lines形式で書き出し、
+finish()で最終サマリーを標準出力とGitHub Actionsのジョブサマリー($GITHUB_STEP_SUMMARY)に出力する。
+ProcessPoolExecutorのワーカーでは drain() で差分を取り出し、親プロセスで merge() する。
+process_age_ms() はプロセスの起動からの経過msを返す (コールドスタートの計測用)。
+"""
+import os
+import sys
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# ヒストグラムのバケット境界 (ms)
+_BUCKET_BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_IMPORTED_AT = time.time()
+_state = {"stage": None, "started_at": None, "path": None, "thread": None, "stop": None, "profiler": None}
+
+
+class _Histogram:
+    __slots__ = ("count", "total", "min", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(_BUCKET_BOUNDS) + 1)
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.buckets[bisect.bisect_left(_BUCKET_BOUNDS, value)] += 1
+
+    def merge(self, data: dict):
+        if not data.get("count"):
+            return
+        self.count += data["count"]
+        self.total += data["sum"]
+        self.min = data["min"] if self.min is None else min(self.min, data["min"])
+        self.max = data["max"] if self.max is None else max(self.max, data["max"])
+        for i, n in enumerate(data["buckets"]):
+            self.buckets[i] += n
+
+    def quantile(self, q: float) -> float:
+        """バケットの上限値で近似した分位点"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target:
+                # 観測値の最大を超える上限値は返さない
+                return min(float(_BUCKET_BOUNDS[i]), self.max) if i < len(_BUCKET_BOUNDS) else self.max
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "sum": round(self.total, 3), "min": self.min, "max": self.max,
+                "buckets": list(self.buckets)}
+
+
+def _reset_in_child():
+    # fork直後の子プロセスは親の値とロックを引き継ぐため、二重計上しないよう空にする
+    global _lock
+    _lock = threading.Lock()
+    _counters.clear()
+    _histograms.clear()
+    _state.update(path=None, thread=None, stop=None, profiler=None)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_in_child)
+
+
+def process_age_ms() -> float:
+    """
+    プロセスの起動からの経過ms。Linuxでは/procの起動時刻を使い、インタープリターの起動時間も含める。
+    取得できない環境ではこのモジュールをimportした時点からの経過msを返す。
+    """
+    try:
+        with open("/proc/self/stat", encoding="ascii") as f:
+            # 2番目の項目(コマンド名)は空白を含みうるため、閉じ括弧より後ろを分割する
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime", encoding="ascii") as f:
+            uptime = float(f.read().split()[0])
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        return max(0.0, (uptime - started) * 1000.0)
+    except (OSError, ValueError, IndexError):
+        return (time.time() - _IMPORTED_AT) * 1000.0
+
+
+# --- Recording API ---
+def incr(name: str, value: float = 1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name: str, value: float):
+    with _lock:
+        hist = _histograms.get(name)
+        if hist is None:
+            hist = _histograms[name] = _Histogram()
+        hist.add(value)
+
+
+@contextmanager
+def timer(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, (time.perf_counter() - start) * 1000.0)
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "histograms": {name: hist.to_dict() for name, hist in _histograms.items()},
+        }
+
+
+def drain() -> dict:
+    """現在値を返してリセットする (ワーカープロセスから親へ差分を渡す用)"""
+    with _lock:
+        data = {
+            "counters": dict(_counters),
+            "histograms": {name: hist.to_dict() for name, hist in _histograms.items()},
+        }
+        _counters.clear()
+        _histograms.clear()
+    return data
+
+
+def merge(data: dict):
+    if not data:
+        return
+    with _lock:
+        for name, value in data.get("counters", {}).items():
+            _counters[name] = _counters.get(name, 0) + value
+        for name, hist_data in data.get("histograms", {}).items():
+            hist = _histograms.get(name)
+            if hist is None:
+                hist = _histograms[name] = _Histogram()
+            hist.merge(hist_data)
+
+
+# --- Reporting ---
+def _write_snapshot(event: str):
+    path = _state["path"]
+    if not path:
+        return
+    record = {
+        "ts": time.time(),
+        "event": event,
+        "stage": _state["stage"],
+        "elapsed_sec": round(time.time() - _state["started_at"], 3),
+        **snapshot(),
+    }
+    data = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+    try:
+        # 複数のプロセス (process_ginza と process_stanza など) が同じファイルに追記しても行が混ざらないよう、
+        # バッファを通さずO_APPENDのディスクリプタに1回のwrite()で書き込む
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            written = os.write(fd, data)
+        finally:
+            os.close(fd)
+        if written != len(data):
+            raise OSError(f"short write ({written} of {len(data)} bytes)")
+    except OSError as e:
+        print(f"[!] Failed to write metrics snapshot: {e}", file=sys.stderr)
+
+
+def _reporter_loop(interval: float, stop_event: threading.Event):
+    while not stop_event.wait(interval):
+        _write_snapshot("snapshot")
+
+
+def _start_profiler(stage: str):
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        print("[!] PROFILE is enabled but pyinstrument is not installed (pip install pyinstrument).", file=sys.stderr)
+        return None
+    profiler = Profiler(interval=0.005)
+    profiler.start()
+    print(f"[*] Sampling profiler started for {stage}.")
+    return profiler
+
+
+def start(stage: str, config=None):
+    """
+    ステージの計測を開始する。config.iniの[Metrics]セクション (環境変数で上書き可) を読む。
+      METRICS_FILE               : スナップショットの出力先 (空なら出力しない) / MTC_METRICS_FILE
+      SNAPSHOT_INTERVAL_SECONDS  : スナップショットの間隔
+      PROFILE                    : trueでpyinstrumentによるサンプリングプロファイルを取る / MTC_PROFILE
+    """
+    path = os.environ.get("MTC_METRICS_FILE")
+    interval = 30.0
+    profile = os.environ.get("MTC_PROFILE", "").lower() in ("1", "true", "yes")
+    if config is not None and config.has_section("Metrics"):
+        path = path if path is not None else config.get("Metrics", "METRICS_FILE", fallback="").strip()
+        interval = config.getfloat("Metrics", "SNAPSHOT_INTERVAL_SECONDS", fallback=interval)
+        profile = profile or config.getboolean("Metrics", "PROFILE", fallback=False)
+
+    _state.update(stage=stage, started_at=time.time(), path=path or None)
+    if _state["path"] and interval > 0:
+        stop_event = threading.Event()
+        thread = threading.Thread(target=_reporter_loop, args=(interval, stop_event), daemon=True)
+        thread.start()
+        _state.update(thread=thread, stop=stop_event)
+    if profile:
+        _state["profiler"] = _start_profiler(stage)
+
+
+def format_summary() -> str:
+    """Markdown形式のサマリー (ジョブサマリーにそのまま貼れる形式)"""
+    data = snapshot()
+    with _lock:
+        hist_stats = {
+            name: (hist.count, hist.total / hist.count if hist.count else 0.0,
+                   hist.quantile(0.5), hist.quantile(0.95), hist.max or 0.0, hist.total)
+            for name, hist in _histograms.items()
+        }
+    elapsed = time.time() - (_state["started_at"] or time.time())
+    lines = [f"### Metrics: {_state['stage']} ({elapsed:.1f}s)", ""]
+    if data["counters"]:
+        lines += ["| counter | value | per sec |", "|---|---:|---:|"]
+        for name in sorted(data["counters"]):
+            value = data["counters"][name]
+            per_sec = value / elapsed if elapsed > 0 else 0.0
+            lines.append(f"| {name} | {value:,.0f} | {per_sec:,.2f} |")
+        lines.append("")
+    if hist_stats:
+        lines += ["| histogram (ms) | count | mean | p50 | p95 | max | total |", "|---|---:|---:|---:|---:|---:|---:|"]
+        for name in sorted(hist_stats):
+            count, mean, p50, p95, max_value, total = hist_stats[name]
+            lines.append(f"| {name} | {count:,} | {mean:,.1f} | {p50:,.0f} | {p95:,.0f} | {max_value:,.1f} | {total:,.0f} |")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def finish():
+    """スナップショットの出力を止め、最終サマリーを出力する"""
+    if _state["stop"] is not None:
+        _state["stop"].set()
+        _state["thread"].join(timeout=5)
+        _state.update(thread=None, stop=None)
+    if _state["started_at"] is None:
+        return
+    _write_snapshot("final")
+
+    summary = format_summary()
+    print("\n" + summary)
+    summary_path = os.environ.get("GITHUB_STEP_SUMMARY")
+    if summary_path:
+        try:
+            with open(summary_path, "a", encoding="utf-8") as f:
+                f.write(summary + "\n")
+        except OSError as e:
+            print(f"[!] Failed to write job summary: {e}", file=sys.stderr)
+
+    profiler = _state["profiler"]
+    if profiler is not None:
+        profiler.stop()
+        output = f"profile-{_state['stage']}.html"
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(profiler.output_html())
+        print(f"[+] Profile written to '{output}'.")
+        _state["profiler"] = None
+
+    # 同じプロセスで次のステージを計測する場合に備えてリセットする
+    drain()
+    _state.update(stage=None, started_at=None, path=None)
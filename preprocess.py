@@ -2,29 +2,53 @@ import os
 import sys
 import re
 import time
+import heapq
 import configparser
-import requests
-import hashlib
 import csv
+import hashlib
+import json
 import argparse  # --- 修正点: argparseをインポート ---
-from datetime import datetime, timezone
-from concurrent.futures import ProcessPoolExecutor, TimeoutError
-from bs4 import BeautifulSoup
-import chardet
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError, wait, FIRST_COMPLETED
+import requests
 from sudachipy import tokenizer, dictionary
+from html_parsing import extract_main_text
+from encoding_utils import detect_encoding
+from fetch_utils import (create_http_session, fetch_html, fetch_outcome, is_retryable,
+                         DEFAULT_MAX_RESPONSE_BYTES, DEFAULT_CHUNK_SIZE, DEFAULT_RETRY_STATUSES)
+from adaptive_concurrency import controller_from_config, retry_delay
+from warc_archive import open_recorder, iter_warc_responses, latest_response_records
+import metrics
 
 # SQLAlchemy関連のインポート
-from db_utils import get_local_db_session, CrawlQueue, SentenceQueue, BoilerplatePattern
+from sqlalchemy import func
+from db_utils import get_local_db_session, lock_sentence_inserts, lock_occurrence_writes, CrawlQueue, SentenceQueue, BoilerplatePattern, WordOccurrence
 
 # (init_worker, extract_and_split_sentences は変更ありません)
 _WORKER_TOKENIZER = None
 _WORK_BOILERPLATE_PATTERNS = []
-def init_worker(dict_type: str):
-    global _WORKER_TOKENIZER, _WORK_BOILERPLATE_PATTERNS
+_WORKER_HTML_BACKEND = None
+_WORKER_HTTP_SESSION = None
+_WORKER_FETCH_LIMITS = (DEFAULT_MAX_RESPONSE_BYTES, DEFAULT_CHUNK_SIZE)
+_WORKER_WARC_RECORDER = None
+# 直近のfetchの結果 (AdaptiveConcurrency.release()の引数)。親プロセスのコントローラーに返す
+_WORKER_LAST_FETCH = None
+def init_worker(dict_type: str, html_backend: str = None,
+                max_response_bytes: int = DEFAULT_MAX_RESPONSE_BYTES, fetch_chunk_size: int = DEFAULT_CHUNK_SIZE,
+                warc_dir: str = None, retry_statuses=DEFAULT_RETRY_STATUSES, user_dict: str = None):
+    global _WORKER_TOKENIZER, _WORK_BOILERPLATE_PATTERNS, _WORKER_HTML_BACKEND, _WORKER_HTTP_SESSION, _WORKER_FETCH_LIMITS
+    global _WORKER_WARC_RECORDER
+    _WORKER_HTML_BACKEND = html_backend
+    _WORKER_FETCH_LIMITS = (max_response_bytes, fetch_chunk_size)
+    if warc_dir and _WORKER_WARC_RECORDER is None:
+        _WORKER_WARC_RECORDER = open_recorder(warc_dir, 'preprocess')
+    if _WORKER_HTTP_SESSION is None:
+        # 同じプロセス内ではコネクションを使い回す
+        _WORKER_HTTP_SESSION = create_http_session(pool_size=1, retry_statuses=retry_statuses)
     if _WORKER_TOKENIZER is None:
-        _WORKER_TOKENIZER = dictionary.Dictionary(dict=dict_type).create()
+        # build_dict_source.py でコンパイルしたユーザー辞書があれば、システム辞書に重ねて読み込む
+        config_json = json.dumps({"user": [user_dict]}) if user_dict else None
+        _WORKER_TOKENIZER = dictionary.Dictionary(config_path=config_json, dict=dict_type).create()
     if not _WORK_BOILERPLATE_PATTERNS:
         session = get_local_db_session()
         try:
@@ -33,14 +57,30 @@ def init_worker(dict_type: str):
         finally:
             session.close()
 
-def extract_and_split_sentences(content: bytes, min_len: int) -> list:
+def _split_sentences(morphemes) -> list:
+    """形態素列を句点(。！？など)と改行で区切って文のリストにする"""
+    sentences, current = [], []
+    for m in morphemes:
+        surface = m.surface()
+        if "\n" in surface:
+            sentences.append("".join(current))
+            current = []
+            continue
+        current.append(surface)
+        if m.part_of_speech()[1] == '句点':
+            sentences.append("".join(current))
+            current = []
+    if current:
+        sentences.append("".join(current))
+    return sentences
+
+def extract_and_split_sentences(content: bytes, min_len: int, encoding: str = None) -> list:
     SAFE_CHUNK_BYTES = 40000
     try:
-        soup = BeautifulSoup(content, 'html5lib')
-        for s in soup(["script", "style", "header", "footer", "nav", "aside", "form"]):
-            s.decompose()
-        all_text = soup.get_text(separator="\n", strip=True)
+        with metrics.timer("parse.text_ms"):
+            all_text = extract_main_text(content, backend=_WORKER_HTML_BACKEND, encoding=encoding)
         if not _WORKER_TOKENIZER: raise RuntimeError("Tokenizer is not initialized.")
+        split_start = time.perf_counter()
         all_sentences_from_text = []
         text_bytes = all_text.encode('utf-8')
         start = 0
@@ -48,7 +88,7 @@ def extract_and_split_sentences(content: bytes, min_len: int) -> list:
             end = start + SAFE_CHUNK_BYTES
             while end < len(text_bytes) and (text_bytes[end] & 0xC0) == 0x80: end -= 1
             chunk_str = text_bytes[start:end].decode('utf-8', 'ignore')
-            sentences_in_chunk = [str(s) for s in _WORKER_TOKENIZER.tokenize(chunk_str, mode=tokenizer.Tokenizer.SplitMode.A)]
+            sentences_in_chunk = _split_sentences(_WORKER_TOKENIZER.tokenize(chunk_str, mode=tokenizer.Tokenizer.SplitMode.A))
             all_sentences_from_text.extend(sentences_in_chunk)
             start = end
         clean_sentences = []
@@ -56,14 +96,52 @@ def extract_and_split_sentences(content: bytes, min_len: int) -> list:
             s = re.sub(r'\s+', ' ', s).strip()
             if len(s) >= min_len and not any(pat in s for pat in _WORK_BOILERPLATE_PATTERNS):
                 clean_sentences.append(s)
+        metrics.observe("sudachi.split_ms", (time.perf_counter() - split_start) * 1000.0)
         return clean_sentences
     except Exception as e:
         print(f"   [!] HTML parsing or sentence splitting error: {e}", file=sys.stderr)
         return []
 
+def _store_sentences(session, queue_item, sentences: list, new_hash: str):
+    """
+    URLに紐づく文を入れ替え、crawl_queueを完了状態にしてコミットする。
+    新しい文は解析器が解析し直すため、古い文から数えたword_occurrencesも消しておく
+    (残すと、ページが変わるたびに新旧の出現回数が積み上がる)。
+    """
+    # コミットするまで解析器にバッチを取得させない (取得済みの範囲の途中に文が増えないようにする)
+    lock_sentence_inserts(session)
+    # processed_atはscore_terms.pyが入れ替わった文書を見つけるのに使うため、ロックを取ってからサーバーの時刻を入れる
+    lock_occurrence_writes(session)
+    session.query(SentenceQueue).filter_by(crawl_queue_id=queue_item.id).delete(synchronize_session=False)
+    session.query(WordOccurrence).filter_by(source_url=queue_item.url).delete(synchronize_session=False)
+
+    if sentences:
+        session.bulk_insert_mappings(SentenceQueue, [{"crawl_queue_id": queue_item.id, "sentence_text": s} for s in sentences])
+        metrics.incr("db.rows_written", len(sentences))
+
+    queue_item.extraction_status = "completed"
+    queue_item.content_hash = new_hash
+    queue_item.processed_at = func.clock_timestamp()
+    with metrics.timer("db.commit_ms"):
+        session.commit()
+
+def _mark_failed(queue_item_id: int):
+    error_session = get_local_db_session()
+    try:
+        error_session.query(CrawlQueue).filter_by(id=queue_item_id).update({"extraction_status": "failed"})
+        error_session.commit()
+    finally:
+        error_session.close()
+
 # --- Main worker function ---
 # --- 修正点: is_debug_mode 引数を追加 ---
-def worker_preprocess_url(queue_item_id: int, request_timeout: int, min_sentence_length: int, is_debug_mode: bool) -> tuple:
+def worker_preprocess_url(queue_item_id: int, request_timeout: int, min_sentence_length: int, is_debug_mode: bool,
+                          allow_retry: bool = False) -> tuple:
+    """
+    allow_retry=True のとき、429/5xx・接続エラーはfailedにせずqueuedに戻して"retry"を返す
+    (親プロセスがRetry-Afterとバックオフを待ってから再投入する)。
+    """
+    global _WORKER_LAST_FETCH
     session = get_local_db_session()
     url_to_process = ""
     try:
@@ -81,56 +159,268 @@ def worker_preprocess_url(queue_item_id: int, request_timeout: int, min_sentence
         session.commit()
 
         # ... (HTTPリクエストとHTML解析) ...
-        http_session = requests.Session()
-        retries = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
-        http_session.mount('https://', HTTPAdapter(max_retries=retries))
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        response = http_session.get(url_to_process, timeout=request_timeout, headers=headers, allow_redirects=True)
-        response.raise_for_status()
-        content_type = response.headers.get("content-type", "").lower()
+        # 本文はストリーミングで読み、HTML以外・上限超過・バイナリは途中で打ち切る
+        max_response_bytes, fetch_chunk_size = _WORKER_FETCH_LIMITS
+        try:
+            fetched = fetch_html(_WORKER_HTTP_SESSION or create_http_session(pool_size=1), url_to_process,
+                                 request_timeout, max_response_bytes, fetch_chunk_size)
+        except requests.exceptions.RequestException as e:
+            _WORKER_LAST_FETCH = fetch_outcome(error=e)
+            if not (allow_retry and is_retryable(e)):
+                raise
+            queue_item.extraction_status = "queued"
+            session.commit()
+            return (queue_item_id, "retry", url_to_process, []) if is_debug_mode else (queue_item_id, "retry")
+        _WORKER_LAST_FETCH = fetch_outcome(fetched)
 
-        if "html" not in content_type:
+        if fetched.status != "ok":
             queue_item.extraction_status = "completed"
             session.commit()
-            return (queue_item_id, "completed_non_html", url_to_process, []) if is_debug_mode else (queue_item_id, "completed_non_html")
+            status = f"completed_{fetched.status}"
+            return (queue_item_id, status, url_to_process, []) if is_debug_mode else (queue_item_id, status)
 
-        new_hash = hashlib.sha256(response.content).hexdigest()
+        if _WORKER_WARC_RECORDER:
+            _WORKER_WARC_RECORDER.write_response(fetched, request_url=url_to_process)
+
+        new_hash = fetched.content_hash
         if queue_item.content_hash and queue_item.content_hash == new_hash:
             queue_item.extraction_status = "completed"
             session.commit()
             return (queue_item_id, "completed_not_modified", url_to_process, []) if is_debug_mode else (queue_item_id, "completed_not_modified")
 
-        sentences = extract_and_split_sentences(response.content, min_sentence_length)
-        
-        session.query(SentenceQueue).filter_by(crawl_queue_id=queue_item.id).delete(synchronize_session=False)
-        
-        if sentences:
-            session.bulk_insert_mappings(SentenceQueue, [{"crawl_queue_id": queue_item.id, "sentence_text": s} for s in sentences])
-
-        queue_item.extraction_status = "completed"
-        queue_item.content_hash = new_hash
-        queue_item.processed_at = datetime.now(timezone.utc)
-        session.commit()
+        sentences = extract_and_split_sentences(fetched.content, min_sentence_length, fetched.encoding)
+        _store_sentences(session, queue_item, sentences, new_hash)
         return (queue_item_id, "completed_success", url_to_process, sentences) if is_debug_mode else (queue_item_id, "completed_success")
 
     except Exception as e:
         if session.is_active: session.rollback()
-        error_session = get_local_db_session()
-        try:
-            error_session.query(CrawlQueue).filter_by(id=queue_item_id).update({"extraction_status": "failed"})
-            error_session.commit()
-        finally:
-            error_session.close()
+        _mark_failed(queue_item_id)
         return (queue_item_id, f"failed: {e}", url_to_process, []) if is_debug_mode else (queue_item_id, f"failed: {e}")
     finally:
         if session.is_active:
             session.close()
 
+# --- Replay worker function ---
+def worker_replay_document(queue_item_id: int, url: str, content: bytes, content_type: str,
+                           min_sentence_length: int, is_debug_mode: bool) -> tuple:
+    """
+    WARCに保存済みのレスポンスから文を抽出し直す (ネットワークにはアクセスしない)。
+    抽出ルールの変更を反映させるため、content_hashが同じでも必ず再抽出する。
+    """
+    session = get_local_db_session()
+    try:
+        queue_item = session.query(CrawlQueue).filter(
+            CrawlQueue.id == queue_item_id
+        ).with_for_update(skip_locked=True).one_or_none()
+
+        if not queue_item:
+            return (queue_item_id, "skipped", url, []) if is_debug_mode else (queue_item_id, "skipped")
+
+        encoding = detect_encoding(content, content_type)
+        sentences = extract_and_split_sentences(content, min_sentence_length, encoding)
+        _store_sentences(session, queue_item, sentences, hashlib.sha256(content).hexdigest())
+        return (queue_item_id, "completed_replayed", url, sentences) if is_debug_mode else (queue_item_id, "completed_replayed")
+
+    except Exception as e:
+        if session.is_active: session.rollback()
+        _mark_failed(queue_item_id)
+        return (queue_item_id, f"failed: {e}", url, []) if is_debug_mode else (queue_item_id, f"failed: {e}")
+    finally:
+        if session.is_active:
+            session.close()
+
+def _run_instrumented(worker_func, *args):
+    """
+    ワーカーの戻り値に、そのワーカープロセスで記録されたメトリクスの差分と
+    fetchの結果 (リクエストしなかった場合はNone) を添えて返す
+    """
+    global _WORKER_LAST_FETCH
+    _WORKER_LAST_FETCH = None
+    result = worker_func(*args)
+    return result, metrics.drain(), _WORKER_LAST_FETCH
+
+def _handle_result(result, worker_metrics, is_debug_mode: bool, debug_results_for_csv: list):
+    metrics.merge(worker_metrics)
+    metrics.incr(f"preprocess.result.{result[1].split(':')[0]}")
+
+    # --- 修正点: デバッグモードの場合のみ結果を詳細に処理 ---
+    if is_debug_mode:
+        item_id, status, url, extracted_sentences = result
+        if "failed" in status:
+            print(f"   [!] Worker for ID {item_id} failed. Reason: {status}")
+        if extracted_sentences:
+            for sentence in extracted_sentences:
+                debug_results_for_csv.append({"url": url, "sentence": sentence})
+    else:
+        item_id, status = result
+        if "failed" in status:
+            print(f"   [!] Worker for ID {item_id} failed. Reason: {status}")
+
+def _collect_results(futures, timeout: int, is_debug_mode: bool, debug_results_for_csv: list):
+    for future in futures:
+        try:
+            result, worker_metrics, _ = future.result(timeout=timeout)
+            _handle_result(result, worker_metrics, is_debug_mode, debug_results_for_csv)
+        except TimeoutError:
+            print(f"   [!] A worker process timed out.", file=sys.stderr)
+        except Exception as e:
+            print(f"   [!] A future raised an exception: {e}", file=sys.stderr)
+
+def _run_adaptive_batch(executor, controller, ids_to_process: list, req_timeout: int, min_sentence_length: int,
+                        is_debug_mode: bool, debug_results_for_csv: list, max_attempts: int,
+                        retry_backoff: float = 1.0):
+    """
+    コントローラーの上限の範囲でだけジョブを投入し、ワーカーが返したfetchの結果で上限を調整する。
+    429/5xxで"retry"になったURLは最大max_attempts回まで投入し直す。Retry-Afterがあればその経過後
+    (コントローラーが待たせる)、なければ retry_delay() の秒数が経ってから投入する。
+    """
+    pending = deque((item_id, 1) for item_id in ids_to_process)
+    delayed = []  # (再投入できる時刻, item_id, attempt) のヒープ
+    in_flight = {}
+
+    def submit(item_id, attempt):
+        allow_retry = attempt < max_attempts
+        future = executor.submit(_run_instrumented, worker_preprocess_url, item_id, req_timeout,
+                                 min_sentence_length, is_debug_mode, allow_retry)
+        in_flight[future] = (item_id, attempt)
+
+    while pending or delayed or in_flight:
+        while delayed and delayed[0][0] <= time.monotonic():
+            _, item_id, attempt = heapq.heappop(delayed)
+            pending.append((item_id, attempt))
+        if not pending and not in_flight:
+            # バックオフ中のURLしか残っていなければ、最初のものが再投入できるまで待つ
+            time.sleep(max(0.0, delayed[0][0] - time.monotonic()))
+            continue
+        # 何も実行中でなければ、Retry-Afterの待機が明けるまでブロックしてでも1件は投入する
+        if pending and not in_flight and controller.acquire():
+            submit(*pending.popleft())
+        while pending and controller.acquire(block=False):
+            submit(*pending.popleft())
+
+        timeout = req_timeout + 60
+        if delayed:
+            timeout = min(timeout, max(0.0, delayed[0][0] - time.monotonic()))
+        done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done and timeout < req_timeout + 60:
+            continue  # バックオフが明けたURLを投入する
+        if not done:
+            print(f"   [!] {len(in_flight)} worker process(es) timed out.", file=sys.stderr)
+            for _ in in_flight:
+                controller.release(error=True)
+            in_flight.clear()
+            break
+
+        for future in done:
+            item_id, attempt = in_flight.pop(future)
+            try:
+                result, worker_metrics, outcome = future.result()
+            except Exception as e:
+                controller.release()
+                print(f"   [!] A future raised an exception: {e}", file=sys.stderr)
+                continue
+            controller.release(**(outcome or {}))
+            if result[1] == "retry":
+                metrics.merge(worker_metrics)
+                metrics.incr("http.retries")
+                if outcome and outcome.get("retry_after") is not None:
+                    pending.append((item_id, attempt + 1))
+                else:
+                    delay = retry_delay(attempt, retry_backoff)
+                    metrics.observe("http.retry_backoff_ms", delay * 1000.0)
+                    heapq.heappush(delayed, (time.monotonic() + delay, item_id, attempt + 1))
+                continue
+            _handle_result(result, worker_metrics, is_debug_mode, debug_results_for_csv)
+
+def process_queue(executor, session, batch_size: int, req_timeout: int, min_sentence_length: int,
+                  is_debug_mode: bool, debug_results_for_csv: list, controller=None, max_attempts: int = 3,
+                  retry_backoff: float = 1.0):
+    """crawl_queueの'queued'なURLをバッチ単位でワーカーに割り当てる"""
+    while True:
+        items_to_process = session.query(CrawlQueue.id).filter(
+            CrawlQueue.extraction_status == 'queued'
+        ).order_by(CrawlQueue.id).limit(batch_size).all()
+        
+        if not items_to_process:
+            print("[*] No URLs to preprocess in queue. Exiting.")
+            break
+        
+        ids_to_process = [item.id for item in items_to_process]
+        print(f"[*] Processing batch of {len(ids_to_process)} URLs...")
+
+        if controller:
+            _run_adaptive_batch(executor, controller, ids_to_process, req_timeout, min_sentence_length,
+                                is_debug_mode, debug_results_for_csv, max_attempts, retry_backoff)
+        else:
+            # --- 修正点: is_debug_modeフラグをワーカーに渡す ---
+            futures = [executor.submit(_run_instrumented, worker_preprocess_url, item_id, req_timeout, min_sentence_length, is_debug_mode) for item_id in ids_to_process]
+            _collect_results(futures, req_timeout + 60, is_debug_mode, debug_results_for_csv)
+        
+        print(f"   [+] Batch complete.")
+
+def replay_archives(warc_paths: list, executor, session, batch_size: int, min_sentence_length: int,
+                    is_debug_mode: bool, debug_results_for_csv: list):
+    """
+    WARCのレスポンスをcrawl_queueのURLに対応付け、ワーカーで文の再抽出を行う。
+    同じURLのレコードが複数あれば、WARC-Dateが最も新しいものだけを使う。
+    """
+    replayed, unknown = 0, 0
+    latest, duplicates = latest_response_records(warc_paths)
+    if duplicates:
+        print(f"   [*] Dropped {duplicates} older duplicate records; replaying the newest response for each URL.")
+
+    def flush(records):
+        nonlocal replayed, unknown
+        urls = [r[0] for r in records]
+        id_by_url = dict(session.query(CrawlQueue.url, CrawlQueue.id).filter(CrawlQueue.url.in_(urls)).all())
+        session.commit()
+        futures = []
+        for url, content, content_type in records:
+            if url not in id_by_url:
+                unknown += 1
+                continue
+            futures.append(executor.submit(_run_instrumented, worker_replay_document, id_by_url[url], url, content,
+                                           content_type, min_sentence_length, is_debug_mode))
+        _collect_results(futures, 60, is_debug_mode, debug_results_for_csv)
+        replayed += len(futures)
+        print(f"   [+] Replayed {replayed} documents...")
+
+    batch = []
+    for url, content, content_type in iter_warc_responses(warc_paths, only=latest):
+        if "html" not in content_type:
+            continue
+        batch.append((url, content, content_type))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    if unknown:
+        print(f"   [-] {unknown} archived URLs were not found in crawl_queue and were skipped.")
+
+def resolve_user_dict(path: str):
+    """
+    ユーザー辞書のパスを実体のファイルに解決する。
+    実行中にbuild_dict_source.pyがuser.dicを差し替えても、全ワーカーが同じ辞書を使うようにするため。
+    """
+    if not path:
+        return None
+    if not os.path.exists(path):
+        print(f"[-] Sudachi user dictionary '{path}' not found. Using the system dictionary only.")
+        return None
+    resolved = os.path.realpath(path)
+    print(f"[*] Using Sudachi user dictionary '{resolved}'.")
+    return resolved
+
 # --- Main process orchestrator ---
 def main():
     # --- 修正点: コマンドライン引数を解析 ---
     parser = argparse.ArgumentParser(description="Preprocess URLs from the crawl queue.")
     parser.add_argument('--debug', action='store_true', help="Enable debug mode to output a CSV artifact.")
+    parser.add_argument('--warc-dir', help="Save fetched HTML responses as gzipped WARC files in this directory.")
+    parser.add_argument('--replay', nargs='+', metavar='WARC',
+                        help="Re-extract sentences from WARC files/directories instead of fetching from the network.")
     args = parser.parse_args()
 
     if args.debug:
@@ -142,56 +432,45 @@ def main():
     batch_size = config.getint('Preprocessor', 'BATCH_SIZE')
     req_timeout = config.getint('General', 'REQUEST_TIMEOUT')
     sudachi_dict_type = config.get('Preprocessor', 'SUDACHI_DICT_TYPE', fallback='full')
+    sudachi_user_dict = resolve_user_dict(config.get('Preprocessor', 'SUDACHI_USER_DICT', fallback='').strip())
     min_sentence_length = config.getint('Preprocessor', 'MIN_SENTENCE_LENGTH', fallback=10)
+    html_backend = config.get('General', 'HTML_PARSER', fallback='lxml')
+    max_response_bytes = config.getint('General', 'MAX_RESPONSE_BYTES', fallback=DEFAULT_MAX_RESPONSE_BYTES)
+    fetch_chunk_size = config.getint('General', 'FETCH_CHUNK_SIZE', fallback=DEFAULT_CHUNK_SIZE)
+    # リプレイ時はネットワークにアクセスしないので、改めて保存はしない
+    warc_dir = None if args.replay else (args.warc_dir or config.get('Archive', 'WARC_DIR', fallback='').strip())
+    if warc_dir:
+        print(f"[*] Fetched responses will be archived to '{warc_dir}'.")
+    # ワーカープロセス数が同時リクエスト数の上限になる。リプレイ時はリクエストしないので制御しない
+    controller = None if args.replay else controller_from_config(config, max_limit=max_workers, name="preprocess.concurrency")
+    retry_statuses = () if controller else DEFAULT_RETRY_STATUSES
+    max_attempts = config.getint('Concurrency', 'MAX_ATTEMPTS', fallback=3)
+    retry_backoff = config.getfloat('Concurrency', 'RETRY_BACKOFF_SECONDS', fallback=1.0)
+    if controller:
+        print(f"[*] Adaptive concurrency: starting at {controller.limit}, up to {controller.max_limit}.")
     
     session = get_local_db_session()
     print("--- Text Extraction Process Started ---")
+    metrics.start("preprocess", config)
     
     # --- 修正点: デバッグモードの時だけリストを初期化 ---
     debug_results_for_csv = [] if args.debug else None
 
     try:
-        while True:
-            items_to_process = session.query(CrawlQueue.id).filter(
-                CrawlQueue.extraction_status == 'queued'
-            ).order_by(CrawlQueue.id).limit(batch_size).all()
-            
-            if not items_to_process:
-                print("[*] No URLs to preprocess in queue. Exiting.")
-                break
-            
-            ids_to_process = [item.id for item in items_to_process]
-            print(f"[*] Processing batch of {len(ids_to_process)} URLs...")
-
-            with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker, initargs=(sudachi_dict_type,)) as executor:
-                # --- 修正点: is_debug_modeフラグをワーカーに渡す ---
-                futures = [executor.submit(worker_preprocess_url, item_id, req_timeout, min_sentence_length, args.debug) for item_id in ids_to_process]
-                
-                for future in futures:
-                    try:
-                        result = future.result(timeout=req_timeout + 60)
-                        
-                        # --- 修正点: デバッグモードの場合のみ結果を詳細に処理 ---
-                        if args.debug:
-                            item_id, status, url, extracted_sentences = result
-                            if "failed" in status:
-                                print(f"   [!] Worker for ID {item_id} failed. Reason: {status}")
-                            if extracted_sentences:
-                                for sentence in extracted_sentences:
-                                    debug_results_for_csv.append({"url": url, "sentence": sentence})
-                        else:
-                            item_id, status = result
-                            if "failed" in status:
-                                print(f"   [!] Worker for ID {item_id} failed. Reason: {status}")
-
-                    except TimeoutError:
-                        print(f"   [!] A worker process timed out.", file=sys.stderr)
-                    except Exception as e:
-                        print(f"   [!] A future raised an exception: {e}", file=sys.stderr)
-            
-            print(f"   [+] Batch complete.")
+        # ワーカーの初期化(Sudachi辞書のロード)はバッチごとではなく1回だけ行う
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker, initargs=(sudachi_dict_type, html_backend, max_response_bytes, fetch_chunk_size, warc_dir, retry_statuses, sudachi_user_dict)) as executor:
+            if args.replay:
+                print(f"[*] Replay mode: re-extracting from {len(args.replay)} WARC path(s).")
+                replay_archives(args.replay, executor, session, batch_size, min_sentence_length,
+                                args.debug, debug_results_for_csv)
+            else:
+                process_queue(executor, session, batch_size, req_timeout, min_sentence_length,
+                              args.debug, debug_results_for_csv, controller, max_attempts, retry_backoff)
+                if controller:
+                    print(f"[*] Final concurrency limit: {controller.limit}")
     finally:
         session.close()
+        metrics.finish()
 
     # --- 修正点: デバッグモードで、かつ結果がある場合のみCSVを書き出す ---
     if args.debug and debug_results_for_csv:
@@ -3,10 +3,139 @@ import time
 import datetime
 import configparser
 import sys
+from sqlalchemy import func, text
 from sqlalchemy.dialects.postgresql import insert
-from db_utils import get_local_db_session, SentenceQueue, UniqueWord
+from db_utils import get_local_db_session, lock_sentence_inserts, lock_occurrence_writes, CrawlQueue, SentenceQueue, UniqueWord, WordOccurrence, AnalysisBatch
+import metrics
+from analyzers import ANALYZER_MODULES
+
+# --- Analyzer registry ---
+# 解析器は名前で登録する。名前はanalysis_batches.analyzerに保存されるため、
+# 新しい解析器を追加するときにスキーマの変更は要らない。
+ANALYZERS = {}
+
+def register_analyzer(name: str, model_loader_func, batch_processor_func, display_name: str = None):
+    """
+    解析器を登録する。batch_processor_funcは (文のリスト, モデル) を受け取り単語のdictのリストを返す。
+    dictに sentence_index (文のリスト内の位置) を含めると、word_occurrencesに出現回数が記録される。
+    """
+    ANALYZERS[name] = {
+        "display_name": display_name or name,
+        "model_loader_func": model_loader_func,
+        "batch_processor_func": batch_processor_func,
+    }
+
+def run_analyzer(name: str):
+    """
+    登録済みの解析器を名前で実行する。
+    analyzer_service.py で同じ解析器のサービスが起動していれば、モデルをロードせずにサービスへバッチを送る。
+    """
+    if name not in ANALYZERS:
+        raise KeyError(f"Unknown analyzer '{name}'. Registered: {', '.join(sorted(ANALYZERS)) or 'none'}")
+    analyzer = ANALYZERS[name]
+    model_loader_func = analyzer["model_loader_func"]
+    batch_processor_func = analyzer["batch_processor_func"]
 
-def run_processor(processor_name, model_loader_func, batch_processor_func, db_status_column):
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    if config.getboolean('AnalyzerService', 'ENABLED', fallback=True):
+        import analyzer_service
+        client = analyzer_service.connect(config, name)
+        if client is not None:
+            model_loader_func = lambda: analyzer_service.ServiceModel(
+                client, analyzer["model_loader_func"], analyzer["batch_processor_func"])
+            batch_processor_func = analyzer_service.process_batch_with_service
+
+    run_processor(
+        processor_name=analyzer["display_name"],
+        model_loader_func=model_loader_func,
+        batch_processor_func=batch_processor_func,
+        analyzer=name,
+    )
+
+def analyzer_watermark(session, analyzer: str) -> int:
+    """解析器が取得済みの最後の文のid (未処理の文はこれより後ろ)"""
+    return session.query(func.coalesce(func.max(AnalysisBatch.last_sentence_id), 0)).filter(
+        AnalysisBatch.analyzer == analyzer
+    ).scalar()
+
+def claim_batch(session, analyzer: str, batch_size: int):
+    """
+    ウォーターマークの次からbatch_size件の文を1つのバッチとして取得し、
+    (バッチ, 文のテキストのリスト, 各文の出典URLのリスト) を返す。
+    同じ解析器のワーカー同士はアドバイザリロックで直列化し、同じ範囲を重複して取得しない。
+    また、preprocessが挿入中の文のコミットを待ってから取得するので、
+    ウォーターマークより小さいidの文が後からコミットされて取り残されることはない。
+    未処理の文がなければNoneを返す。
+    """
+    session.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": f"analysis_batches:{analyzer}"})
+    lock_sentence_inserts(session, exclusive=True)
+    watermark = analyzer_watermark(session, analyzer)
+    rows = session.query(SentenceQueue.id, SentenceQueue.sentence_text, CrawlQueue.url).join(
+        CrawlQueue, CrawlQueue.id == SentenceQueue.crawl_queue_id
+    ).filter(
+        SentenceQueue.id > watermark
+    ).order_by(SentenceQueue.id).limit(batch_size).all()
+    if not rows:
+        session.rollback()
+        return None
+
+    batch = AnalysisBatch(analyzer=analyzer, first_sentence_id=rows[0].id, last_sentence_id=rows[-1].id,
+                          sentence_count=len(rows), status='processing')
+    session.add(batch)
+    session.commit()  # ロックもここで解放される
+    return batch, [row.sentence_text for row in rows], [row.url for row in rows]
+
+def save_discovered_words(session, discovered_words: list, source_urls: list) -> int:
+    """
+    単語をunique_wordsに、出典URLごとの出現回数をword_occurrencesに保存する。
+    新しく追加されたunique_wordsの行数を返す。
+    """
+    occurrences = {}
+    unique = {}
+    for w in discovered_words:
+        index = w.pop("sentence_index", None)
+        key = (w["word"], w["source_tool"])
+        unique.setdefault(key, w)
+        if index is not None:
+            occurrences[(key, source_urls[index])] = occurrences.get((key, source_urls[index]), 0) + 1
+
+    # 'unique_word_per_tool'制約を利用して、重複を無視した挿入を行う
+    stmt = insert(UniqueWord).values(list(unique.values())).on_conflict_do_nothing(
+        index_elements=['word', 'source_tool']
+    ).returning(UniqueWord.id)
+    inserted = len(session.execute(stmt).all())
+
+    if occurrences:
+        words = {key[0] for key in unique}
+        word_ids = {
+            (row.word, row.source_tool): row.id
+            for row in session.query(UniqueWord.id, UniqueWord.word, UniqueWord.source_tool).filter(UniqueWord.word.in_(words))
+        }
+        rows = [
+            {"word_id": word_ids[key], "source_url": url, "occurrence_count": count, "updated_at": func.clock_timestamp()}
+            for (key, url), count in occurrences.items() if key in word_ids
+        ]
+        # 1つのURLの文は複数のバッチに分かれるため、バッチごとの出現回数を積み上げる。
+        # ページの内容が変わって文が入れ替わるときは、preprocessがそのURLの行を先に消すので二重には数えない
+        # (score_terms.pyはupdated_atで差分を読み込む。ロックを取ってからサーバーの時刻を入れる)
+        lock_occurrence_writes(session)
+        stmt = insert(WordOccurrence).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['word_id', 'source_url'],
+            set_={"occurrence_count": WordOccurrence.occurrence_count + stmt.excluded.occurrence_count,
+                  "updated_at": stmt.excluded.updated_at},
+        )
+        session.execute(stmt)
+        metrics.incr("db.occurrences_written", len(rows))
+    return inserted
+
+def run_processor(processor_name, model_loader_func, batch_processor_func, analyzer: str = None):
+    """
+    analysis_batchesでバッチを取得しながら、文を解析して未知語をunique_wordsに保存する。
+    analyzerを省略した場合はprocessor_nameを小文字にしたものを使う。
+    """
+    analyzer = analyzer or processor_name.lower()
     config = configparser.ConfigParser()
     config.read('config.ini')
 
@@ -18,8 +147,16 @@ def run_processor(processor_name, model_loader_func, batch_processor_func, db_st
     if duration_minutes > 0:
         print(f"[*] This process will run for a maximum of {duration_minutes} minutes.")
 
+    metrics.start(processor_name.lower(), config)
+    # コールドスタートの内訳: プロセス起動からここまで (インタープリターとimport) / モデルのロード / 最初のバッチの完了
+    imports_ms = metrics.process_age_ms()
+    metrics.observe("startup.imports_ms", imports_ms)
+
     print(f"[*] Loading {processor_name} model...")
+    load_started = time.perf_counter()
     nlp_model = model_loader_func()
+    model_load_ms = (time.perf_counter() - load_started) * 1000.0
+    metrics.observe("nlp.model_load_ms", model_load_ms)
     print(f"[+] {processor_name} model loaded.")
 
     batch_size = config.getint('Processor', 'BATCH_SIZE', fallback=100)
@@ -32,47 +169,46 @@ def run_processor(processor_name, model_loader_func, batch_processor_func, db_st
                 print(f"\n[*] Time limit reached. Exiting gracefully.")
                 break
 
-            items_to_process = session.query(SentenceQueue).filter(
-                db_status_column == 'queued'
-            ).order_by(SentenceQueue.id).limit(batch_size).with_for_update(skip_locked=True).all()
+            with metrics.timer("db.claim_ms"):
+                claimed = claim_batch(session, analyzer, batch_size)
 
-            if not items_to_process:
+            if not claimed:
                 print("\n[*] No more sentences to process. Exiting.")
                 break
 
-            ids_to_process = [item.id for item in items_to_process]
-            sentences_to_process = [item.sentence_text for item in items_to_process]
-
-            session.query(SentenceQueue).filter(
-                SentenceQueue.id.in_(ids_to_process)
-            ).update({db_status_column.name: "processing"}, synchronize_session=False)
-            session.commit()
+            batch, sentences_to_process, source_urls = claimed
             
             try:
                 # --- 修正点 1: batch_processor_funcから単語リストを受け取る ---
-                discovered_words = batch_processor_func(sentences_to_process, nlp_model)
+                with metrics.timer("nlp.inference_ms"):
+                    discovered_words = batch_processor_func(sentences_to_process, nlp_model)
+                metrics.incr("nlp.words_found", len(discovered_words))
                 
                 # --- 修正点 2: 受け取った単語をDBに保存する ---
                 if discovered_words:
-                    # 'unique_word_per_tool'制約を利用して、重複を無視した挿入を行う
-                    stmt = insert(UniqueWord).values(discovered_words).on_conflict_do_nothing(
-                        index_elements=['word', 'source_tool']
-                    )
-                    session.execute(stmt)
+                    with metrics.timer("db.insert_ms"):
+                        inserted = save_discovered_words(session, discovered_words, source_urls)
+                    metrics.incr("db.rows_written", inserted)
 
-                session.query(SentenceQueue).filter(
-                    SentenceQueue.id.in_(ids_to_process)
-                ).update({db_status_column.name: "completed"}, synchronize_session=False)
+                batch.status = "completed"
+                batch.completed_at = datetime.datetime.now(datetime.timezone.utc)
 
             except Exception as e:
+                metrics.incr("nlp.batches_failed")
                 print(f"\n[!] Error processing batch: {e}", file=sys.stderr)
-                session.rollback() # エラー時は単語もステータスも更新しない
-                session.query(SentenceQueue).filter(
-                    SentenceQueue.id.in_(ids_to_process)
-                ).update({db_status_column.name: "failed"}, synchronize_session=False)
+                session.rollback() # エラー時は単語を保存せず、バッチを失敗として記録する
+                batch.status = "failed"
+                batch.completed_at = datetime.datetime.now(datetime.timezone.utc)
 
-            session.commit()
-            total_processed_count += len(items_to_process)
+            with metrics.timer("db.commit_ms"):
+                session.commit()
+            metrics.incr("nlp.sentences", len(sentences_to_process))
+            if total_processed_count == 0:
+                first_batch_ms = metrics.process_age_ms()
+                metrics.observe("startup.first_batch_ms", first_batch_ms)
+                print(f"[*] Cold start: first batch after {first_batch_ms:.0f} ms "
+                      f"(imports {imports_ms:.0f} ms, model load {model_load_ms:.0f} ms)")
+            total_processed_count += len(sentences_to_process)
             print(f"\r[*] Processed {total_processed_count} sentences...", end="")
 
     except Exception as e:
@@ -81,4 +217,5 @@ def run_processor(processor_name, model_loader_func, batch_processor_func, db_st
             session.rollback()
     finally:
         session.close()
+        metrics.finish()
         print(f"\n--- [{processor_name}] Process Finished ---")
\ No newline at end of file
@@ -1,10 +1,9 @@
 # process_ginza.py (修正後の完全なコード)
-import spacy
-from process_common import run_processor
-from db_utils import SentenceQueue
+from process_common import register_analyzer, run_analyzer
 
 def load_ginza_model():
-    """GiNZAモデルをロードする"""
+    """GiNZAモデルをロードする (spaCyは読み込みが重いため、モデルを使うときに初めてimportする)"""
+    import spacy
     return spacy.load("ja_ginza_electra")
 
 def process_batch_with_ginza(sentences, nlp):
@@ -14,24 +13,22 @@ def process_batch_with_ginza(sentences, nlp):
     discovered_words = []
     docs = nlp.pipe(sentences)
     
-    for doc in docs:
+    for index, doc in enumerate(docs):
         for token in doc:
             # is_oovフラグがTrueの単語（未知語）のみを抽出
             if token.is_oov:
                 discovered_words.append({
                     "word": token.lemma_,  # 見出し語（基本形）
                     "source_tool": "ginza",
-                    "pos_tag": token.pos_ # 品詞タグ
+                    "pos_tag": token.pos_, # 品詞タグ
+                    "sentence_index": index # 出現回数の集計用 (何番目の文か)
                 })
     return discovered_words
 
+register_analyzer("ginza", load_ginza_model, process_batch_with_ginza, display_name="GiNZA")
+
 def main():
-    run_processor(
-        processor_name="GiNZA",
-        model_loader_func=load_ginza_model,
-        batch_processor_func=process_batch_with_ginza,
-        db_status_column=SentenceQueue.ginza_status
-    )
+    run_analyzer("ginza")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
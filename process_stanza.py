@@ -1,10 +1,9 @@
 # process_stanza.py (修正後の完全なコード)
-import stanza
-from process_common import run_processor
-from db_utils import SentenceQueue
+from process_common import register_analyzer, run_analyzer
 
 def load_stanza_model():
-    """Stanzaモデルをロードする"""
+    """Stanzaモデルをロードする (Stanzaは読み込みが重いため、モデルを使うときに初めてimportする)"""
+    import stanza
     stanza.download('ja', verbose=False)
     return stanza.Pipeline('ja', verbose=False, processors='tokenize,pos,lemma,ner')
 
@@ -12,13 +11,14 @@ def process_batch_with_stanza(sentences, nlp):
     """
     Stanzaを使って文章のバッチを処理し、固有名詞のリストを返す
     """
+    import stanza
     discovered_words = []
     
     # StanzaのDocumentオブジェクトを作成して一括処理
     docs = [stanza.Document([], text=s) for s in sentences]
     processed_docs = nlp.bulk_process(docs)
     
-    for doc in processed_docs:
+    for index, doc in enumerate(processed_docs):
         for sent in doc.sentences:
             for word in sent.words:
                 # 品詞(pos)が固有名詞(PROPN)のものを抽出
@@ -27,17 +27,15 @@ def process_batch_with_stanza(sentences, nlp):
                         "word": word.lemma,  # 見出し語（基本形）
                         "source_tool": "stanza",
                         "pos_tag": word.pos,
-                        "entity_category": word.parent.ner # 固有表現カテゴリ (e.g., PERSON)
+                        "entity_category": word.parent.ner, # 固有表現カテゴリ (e.g., PERSON)
+                        "sentence_index": index # 出現回数の集計用 (何番目の文か)
                     })
     return discovered_words
 
+register_analyzer("stanza", load_stanza_model, process_batch_with_stanza, display_name="Stanza")
+
 def main():
-    run_processor(
-        processor_name="Stanza",
-        model_loader_func=load_stanza_model,
-        batch_processor_func=process_batch_with_stanza,
-        db_status_column=SentenceQueue.stanza_status
-    )
+    run_analyzer("stanza")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
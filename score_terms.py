@@ -0,0 +1,415 @@
+# score_terms.py
+"""
+unique_words の候補語にスコアを付け、term_scores テーブルに書き出す。
+
+word_occurrences (語 × 出典URL × 出現回数) から語 × 文書の疎行列を解析器ごとに作り、
+以下をすべて行列演算でまとめて計算する。
+
+- document_frequency : 語が現れた文書数
+- tfidf              : Σ_文書 log(1 + tf) × idf
+- c_value            : 複合語らしさ (C-value)。より長い候補語に含まれる場合の補正を行う
+- tool_agreement     : 語が現れた文書のうち、2つ以上の解析器 (GiNZA/Stanza) が同じ語を出した文書の割合
+- score              : 上記のパーセンタイル順位を [Scoring] の重みで足し合わせたもの (0〜1)
+
+行列は CACHE_FILE (.npz) に保存し、次回は word_occurrences.updated_at が前回より新しい行だけを読み込んで更新する。
+読み込みの上限は lock_occurrence_writes の排他ロックを取って読んだサーバーの時刻で、次回はそこから読み込む。
+preprocessが文を入れ替えたURL (crawl_queue.processed_at が前回より新しいもの) は、
+word_occurrencesの行が消されているため、行列からもいったん取り除いてから読み込み直す。
+その結果どの文書にも現れなくなった語は、行列からも term_scores からも削除する。
+値が SCORE_TOLERANCE 以上変わった語だけを term_scores に書き戻す。
+ただし term_scores が空のとき (CIで毎回作り直すローカルDBにキャッシュだけが引き継がれた場合など) は全語を書き込む。
+
+    python score_terms.py
+    python score_terms.py --full   # キャッシュを使わずに全件から計算し直す
+"""
+import os
+import sys
+import time
+import argparse
+import configparser
+from datetime import datetime, timezone
+
+import numpy as np
+from scipy import sparse
+from scipy.stats import rankdata
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+
+from db_utils import get_local_db_session, lock_occurrence_writes, CrawlQueue, UniqueWord, WordOccurrence, TermScore
+import metrics
+
+SCORE_COLUMNS = ("document_frequency", "total_count", "tfidf", "c_value", "tool_count", "tool_agreement", "score")
+MIN_TERM_LENGTH = 2
+
+
+class TermMatrix:
+    """
+    (解析器, 語, 文書) ごとの出現回数を座標形式で保持する。
+    文書・解析器の語彙は追加のみで、インデックスは変わらない。
+    語の語彙は drop_unused_terms() でどの文書にも現れなくなった語を取り除くときだけ詰め直す。
+    """
+
+    def __init__(self, terms=(), docs=(), tools=(), term_idx=None, doc_idx=None, tool_idx=None, counts=None,
+                 watermark: float = 0.0, scores: dict = None):
+        self.terms = list(terms)
+        self.docs = list(docs)
+        self.tools = list(tools)
+        self.term_index = {t: i for i, t in enumerate(self.terms)}
+        self.doc_index = {d: i for i, d in enumerate(self.docs)}
+        self.tool_index = {t: i for i, t in enumerate(self.tools)}
+        self.term_idx = np.asarray(term_idx if term_idx is not None else [], dtype=np.int64)
+        self.doc_idx = np.asarray(doc_idx if doc_idx is not None else [], dtype=np.int64)
+        self.tool_idx = np.asarray(tool_idx if tool_idx is not None else [], dtype=np.int64)
+        self.counts = np.asarray(counts if counts is not None else [], dtype=np.int64)
+        self.watermark = watermark
+        # 前回term_scoresに書き込んだ値 (変化した語だけを書き戻すために使う)
+        self.scores = scores or {}
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path, allow_pickle=False) as data:
+            scores = {name: data[f"score_{name}"] for name in SCORE_COLUMNS if f"score_{name}" in data}
+            return cls(data["terms"].tolist(), data["docs"].tolist(), data["tools"].tolist(),
+                       data["term_idx"], data["doc_idx"], data["tool_idx"], data["counts"],
+                       float(data["watermark"]), scores)
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            terms=np.array(self.terms, dtype=str), docs=np.array(self.docs, dtype=str),
+            tools=np.array(self.tools, dtype=str),
+            term_idx=self.term_idx, doc_idx=self.doc_idx, tool_idx=self.tool_idx, counts=self.counts,
+            watermark=np.float64(self.watermark),
+            **{f"score_{name}": values for name, values in self.scores.items()},
+        )
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _intern(value, vocab: list, index: dict) -> int:
+        i = index.get(value)
+        if i is None:
+            i = index[value] = len(vocab)
+            vocab.append(value)
+        return i
+
+    def update(self, rows):
+        """
+        (語, 解析器, 文書, 出現回数) の行を取り込む。
+        word_occurrencesの出現回数は累計なので、同じ (解析器, 語, 文書) は最新の値で置き換える。
+        """
+        new_terms, new_docs, new_tools, new_counts = [], [], [], []
+        for word, tool, url, count in rows:
+            new_terms.append(self._intern(word, self.terms, self.term_index))
+            new_tools.append(self._intern(tool, self.tools, self.tool_index))
+            new_docs.append(self._intern(url, self.docs, self.doc_index))
+            new_counts.append(count)
+        if not new_counts:
+            return 0
+
+        term_idx = np.concatenate([self.term_idx, np.array(new_terms, dtype=np.int64)])
+        doc_idx = np.concatenate([self.doc_idx, np.array(new_docs, dtype=np.int64)])
+        tool_idx = np.concatenate([self.tool_idx, np.array(new_tools, dtype=np.int64)])
+        counts = np.concatenate([self.counts, np.array(new_counts, dtype=np.int64)])
+
+        # 後から追加した値を優先して重複を除く (逆順にしてnp.uniqueの最初の出現を使う)
+        keys = (tool_idx * len(self.terms) + term_idx) * len(self.docs) + doc_idx
+        _, first = np.unique(keys[::-1], return_index=True)
+        keep = len(keys) - 1 - first
+        self.term_idx, self.doc_idx, self.tool_idx, self.counts = term_idx[keep], doc_idx[keep], tool_idx[keep], counts[keep]
+        return len(new_counts)
+
+    def remove_docs(self, rows) -> int:
+        """
+        (文書,) の行で渡された文書の値をすべて取り除き、取り除いた数を返す。
+        文書の語彙とインデックスはそのまま残す (後から同じ文書の行が来れば同じ列に入る)。
+        """
+        doc_ids = {self.doc_index[url] for url, in rows if url in self.doc_index}
+        if not doc_ids:
+            return 0
+        keep = ~np.isin(self.doc_idx, np.fromiter(doc_ids, dtype=np.int64, count=len(doc_ids)))
+        removed = int(len(keep) - keep.sum())
+        self.term_idx, self.doc_idx, self.tool_idx, self.counts = (
+            self.term_idx[keep], self.doc_idx[keep], self.tool_idx[keep], self.counts[keep])
+        return removed
+
+    def drop_unused_terms(self) -> list:
+        """
+        どの文書にも現れなくなった語を語彙から取り除き、取り除いた語のリストを返す。
+        前回の値 (scores) も残った語だけに詰め直す。
+        """
+        used = np.zeros(len(self.terms), dtype=bool)
+        used[self.term_idx[self.counts > 0]] = True
+        if used.all():
+            return []
+        dropped = [t for t, u in zip(self.terms, used) if not u]
+        keep = self.counts > 0
+        new_index = np.cumsum(used) - 1
+        self.term_idx, self.doc_idx, self.tool_idx, self.counts = (
+            new_index[self.term_idx[keep]], self.doc_idx[keep], self.tool_idx[keep], self.counts[keep])
+        self.scores = {name: values[used[:len(values)]] for name, values in self.scores.items()}
+        self.terms = [t for t, u in zip(self.terms, used) if u]
+        self.term_index = {t: i for i, t in enumerate(self.terms)}
+        return dropped
+
+    def tool_matrices(self) -> list:
+        """解析器ごとの 語 × 文書 のCSR行列"""
+        shape = (len(self.terms), len(self.docs))
+        matrices = []
+        for tool in range(len(self.tools)):
+            mask = self.tool_idx == tool
+            matrices.append(sparse.csr_matrix(
+                (self.counts[mask].astype(np.float64), (self.term_idx[mask], self.doc_idx[mask])), shape=shape))
+        return matrices
+
+
+def nested_pairs(terms: list):
+    """
+    候補語aがより長い候補語bの部分文字列になっている (a, b) の組をすべて列挙する。
+    語の長さをLとするとO(L^2)の部分文字列をdictで引くだけなので、数十万語でも数秒で終わる。
+    """
+    index = {t: i for i, t in enumerate(terms)}
+    shorter, longer = [], []
+    for b, term in enumerate(terms):
+        n = len(term)
+        if n <= MIN_TERM_LENGTH:
+            continue
+        seen = set()
+        for length in range(MIN_TERM_LENGTH, n):
+            for start in range(n - length + 1):
+                a = index.get(term[start:start + length])
+                if a is not None and a not in seen:
+                    seen.add(a)
+                    shorter.append(a)
+                    longer.append(b)
+    return np.array(shorter, dtype=np.int64), np.array(longer, dtype=np.int64)
+
+
+def c_values(terms: list, frequency: np.ndarray) -> np.ndarray:
+    """
+    C-value = log2|a| × (f(a) - Σ_{b⊃a} f(b) / P(T_a))  (Frantzi et al.)
+    解析器は長い語の中に含まれる短い語を別に数えないため、f(a)には含まれている長い語の出現回数を足してから補正する。
+    """
+    n_terms = len(terms)
+    lengths = np.fromiter((len(t) for t in terms), dtype=np.float64, count=n_terms)
+    a_idx, b_idx = nested_pairs(terms)
+    nested_freq = np.bincount(a_idx, weights=frequency[b_idx], minlength=n_terms)
+    nested_n = np.bincount(a_idx, minlength=n_terms)
+    substring_freq = frequency + nested_freq
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corrected = np.where(nested_n > 0, substring_freq - nested_freq / np.maximum(nested_n, 1), frequency)
+    return np.log2(np.maximum(lengths, 1.0)) * corrected
+
+
+def compute_scores(matrix: TermMatrix, weights: dict) -> dict:
+    """語ごとの統計量とスコアを配列で返す"""
+    per_tool = matrix.tool_matrices()
+    n_docs = len(matrix.docs)
+
+    # 解析器をまとめた出現回数は、同じ文書では多い方を採る (同じ出現を二重に数えない)
+    combined = per_tool[0]
+    for m in per_tool[1:]:
+        combined = combined.maximum(m)
+    combined = combined.tocsr()
+
+    total_count = np.asarray(combined.sum(axis=1)).ravel()
+    document_frequency = combined.getnnz(axis=1)
+    idf = np.log((1.0 + n_docs) / (1.0 + document_frequency)) + 1.0
+    tfidf = np.asarray(combined.log1p().sum(axis=1)).ravel() * idf
+
+    with metrics.timer("score.c_value_ms"):
+        c_value = c_values(matrix.terms, total_count)
+
+    # 文書ごとに何種類の解析器がその語を出したか
+    hits = sum((m > 0).astype(np.int32) for m in per_tool).tocsr()
+    tool_count = sum((m.getnnz(axis=1) > 0).astype(np.int32) for m in per_tool)
+    docs_any = hits.getnnz(axis=1)
+    docs_agreed = (hits >= 2).getnnz(axis=1)
+    tool_agreement = np.divide(docs_agreed, docs_any, out=np.zeros(len(docs_any)), where=docs_any > 0)
+
+    n_terms = len(matrix.terms)
+    def percentile(values):
+        return (rankdata(values, method="average") - 1) / max(n_terms - 1, 1)
+
+    score = (weights["tfidf"] * percentile(tfidf)
+             + weights["c_value"] * percentile(c_value)
+             + weights["document_frequency"] * percentile(document_frequency)
+             + weights["tool_agreement"] * tool_agreement)
+    total_weight = sum(weights.values()) or 1.0
+
+    return {
+        "document_frequency": document_frequency.astype(np.int64),
+        "total_count": total_count.astype(np.int64),
+        "tfidf": tfidf,
+        "c_value": c_value,
+        "tool_count": tool_count.astype(np.int64),
+        "tool_agreement": tool_agreement,
+        "score": score / total_weight,
+    }
+
+
+def changed_terms(previous: dict, current: dict, tolerance: float) -> np.ndarray:
+    """前回書き込んだ値から変化した語のインデックス (新しい語を含む)"""
+    n_terms = len(current["score"])
+    if not previous:
+        return np.arange(n_terms)
+    n_prev = len(previous["score"])
+    changed = np.zeros(n_terms, dtype=bool)
+    changed[n_prev:] = True
+    for name in SCORE_COLUMNS:
+        old, new = previous[name], current[name][:n_prev]
+        changed[:n_prev] |= ~np.isclose(old, new, rtol=tolerance, atol=tolerance)
+    return np.flatnonzero(changed)
+
+
+def read_until(session) -> datetime:
+    """
+    今回読み込む範囲の上限。書き込み中のトランザクションがコミットし終わるのを排他ロックで待ってから
+    サーバーの時刻を読むため、これより前の時刻を持つ行が後からコミットされることはない。
+    """
+    lock_occurrence_writes(session, exclusive=True)
+    until = session.execute(text("SELECT clock_timestamp()")).scalar_one()
+    session.commit()  # ロックはすぐに解放する
+    return until
+
+
+def iter_occurrences(session, since: float, until: datetime, chunk_size: int):
+    """watermarkより後、until以前に更新されたword_occurrencesを (語, 解析器, 文書, 出現回数) で返す"""
+    query = session.query(
+        UniqueWord.word, UniqueWord.source_tool, WordOccurrence.source_url, WordOccurrence.occurrence_count,
+    ).join(UniqueWord, UniqueWord.id == WordOccurrence.word_id).filter(WordOccurrence.updated_at <= until)
+    if since:
+        query = query.filter(WordOccurrence.updated_at > datetime.fromtimestamp(since, tz=timezone.utc))
+    return query.yield_per(chunk_size)
+
+
+def iter_reprocessed_docs(session, since: float, until: datetime, chunk_size: int):
+    """watermarkより後、until以前にpreprocessが文を入れ替えたURLを (文書,) で返す"""
+    return session.query(CrawlQueue.url).filter(
+        CrawlQueue.processed_at > datetime.fromtimestamp(since, tz=timezone.utc),
+        CrawlQueue.processed_at <= until,
+    ).yield_per(chunk_size)
+
+
+def delete_scores(session, words: list, batch_size: int):
+    """どの文書にも現れなくなった語をterm_scoresから消す (コミットはwrite_scoresでまとめて行う)"""
+    for start in range(0, len(words), batch_size):
+        chunk = words[start:start + batch_size]
+        with metrics.timer("db.delete_ms"):
+            deleted = session.query(TermScore).filter(TermScore.word.in_(chunk)).delete(synchronize_session=False)
+        metrics.incr("db.rows_deleted", deleted)
+
+
+def write_scores(session, matrix: TermMatrix, scores: dict, indices: np.ndarray, batch_size: int):
+    now = datetime.now(timezone.utc)
+    for start in range(0, len(indices), batch_size):
+        chunk = indices[start:start + batch_size]
+        rows = [
+            {"word": matrix.terms[i], "updated_at": now,
+             **{name: scores[name][i].item() for name in SCORE_COLUMNS}}
+            for i in chunk
+        ]
+        stmt = insert(TermScore).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['word'],
+            set_={name: stmt.excluded[name] for name in (*SCORE_COLUMNS, "updated_at")},
+        )
+        with metrics.timer("db.upsert_ms"):
+            session.execute(stmt)
+        metrics.incr("db.rows_written", len(rows))
+    with metrics.timer("db.commit_ms"):
+        session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score candidate terms and write them to term_scores.")
+    parser.add_argument('--full', action='store_true', help="Ignore the cached matrix and rebuild from all occurrences.")
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    cache_file = config.get('Scoring', 'CACHE_FILE', fallback='.score_cache/term_matrix.npz')
+    chunk_size = config.getint('Scoring', 'READ_CHUNK_SIZE', fallback=50000)
+    write_batch_size = config.getint('Scoring', 'WRITE_BATCH_SIZE', fallback=1000)
+    tolerance = config.getfloat('Scoring', 'SCORE_TOLERANCE', fallback=0.001)
+    weights = {
+        "tfidf": config.getfloat('Scoring', 'WEIGHT_TFIDF', fallback=1.0),
+        "c_value": config.getfloat('Scoring', 'WEIGHT_C_VALUE', fallback=1.0),
+        "document_frequency": config.getfloat('Scoring', 'WEIGHT_DOCUMENT_FREQUENCY', fallback=0.5),
+        "tool_agreement": config.getfloat('Scoring', 'WEIGHT_TOOL_AGREEMENT', fallback=1.0),
+    }
+
+    print("--- Term Scoring Started ---")
+    metrics.start("score", config)
+    session = get_local_db_session()
+    try:
+        if os.path.exists(cache_file) and not args.full:
+            matrix = TermMatrix.load(cache_file)
+            print(f"[*] Loaded cached matrix: {len(matrix.terms)} terms x {len(matrix.docs)} documents.")
+        else:
+            matrix = TermMatrix()
+
+        with metrics.timer("score.load_ms"):
+            since, until = matrix.watermark, read_until(session)
+            # 先に入れ替わった文書を取り除き、そのあとで現在の行を読み込む
+            removed = matrix.remove_docs(iter_reprocessed_docs(session, since, until, chunk_size)) if since else 0
+            loaded = matrix.update(iter_occurrences(session, since, until, chunk_size))
+            dropped = matrix.drop_unused_terms()
+            session.commit()
+        matrix.watermark = until.timestamp()
+        metrics.incr("score.occurrences_removed", removed)
+        metrics.incr("score.occurrences_loaded", loaded)
+        metrics.incr("score.terms_dropped", len(dropped))
+        print(f"[*] Loaded {loaded} new or updated occurrences ({removed} removed from re-extracted pages).")
+        if dropped:
+            print(f"[*] {len(dropped)} terms no longer appear in any document. Deleting them from term_scores...")
+            delete_scores(session, dropped, write_batch_size)
+        if not matrix.terms:
+            print("[-] No occurrences to score.")
+            with metrics.timer("db.commit_ms"):
+                session.commit()
+            matrix.save(cache_file)
+            return
+        # 書き込み先が空なら、前回の値と比べずに全語を書き込む
+        target_empty = session.query(TermScore.word).limit(1).first() is None
+        if not loaded and not removed and matrix.scores and not target_empty:
+            print("[*] Nothing changed since the last run.")
+            matrix.save(cache_file)  # 読み込みの上限だけ進める
+            return
+
+        start = time.perf_counter()
+        with metrics.timer("score.compute_ms"):
+            scores = compute_scores(matrix, weights)
+        print(f"[+] Scored {len(matrix.terms)} terms over {len(matrix.docs)} documents "
+              f"in {time.perf_counter() - start:.2f}s.")
+
+        if target_empty:
+            indices = np.arange(len(matrix.terms))
+            print(f"[*] term_scores is empty. Writing all {len(indices)} scores...")
+        else:
+            indices = changed_terms(matrix.scores, scores, tolerance)
+            print(f"[*] Writing {len(indices)} changed scores to term_scores...")
+        write_scores(session, matrix, scores, indices, write_batch_size)
+        metrics.incr("score.terms_written", len(indices))
+
+        # 書き込みに成功してからキャッシュを更新する
+        matrix.scores = scores
+        matrix.save(cache_file)
+
+        top = np.argsort(-scores["score"])[:10]
+        print("[*] Top terms:")
+        for i in top:
+            print(f"    {scores['score'][i]:.3f}  {matrix.terms[i]}")
+    except Exception as e:
+        print(f"[!] Term scoring failed: {e}", file=sys.stderr)
+        session.rollback()
+        sys.exit(1)
+    finally:
+        session.close()
+        metrics.finish()
+        print("--- Term Scoring Finished ---")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+-- =========== 解析器ごとの処理状態を analysis_batches に移行 ============
+-- sentence_queue の ginza_status / stanza_status (解析器ごとの列) を、
+-- 解析器ごとの処理済み範囲 (sentence_queue.id の連続範囲) を記録する細いテーブルに置き換える。
+-- 解析器を追加しても列の追加は不要になる。
+
+-- 1. 処理済み範囲を記録するテーブル
+CREATE TABLE IF NOT EXISTS public.analysis_batches (
+  id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  analyzer TEXT NOT NULL,
+  first_sentence_id BIGINT NOT NULL,
+  last_sentence_id BIGINT NOT NULL,
+  sentence_count INTEGER NOT NULL,
+  status public.process_status_enum NOT NULL DEFAULT 'processing',
+  claimed_at TIMESTAMPTZ DEFAULT NOW() NOT NULL,
+  completed_at TIMESTAMPTZ,
+  CONSTRAINT unique_batch_per_analyzer UNIQUE (analyzer, first_sentence_id)
+);
+CREATE INDEX IF NOT EXISTS ix_analysis_batches_analyzer_last
+  ON public.analysis_batches (analyzer, last_sentence_id);
+
+-- 2. 既存の状態からウォーターマークを作る
+--    先頭から連続して completed になっている範囲を1つの完了バッチとして登録する。
+--    それより後ろの文は (途中にcompletedがあっても) 再解析される。unique_words は重複を無視して挿入するため影響はない。
+INSERT INTO public.analysis_batches (analyzer, first_sentence_id, last_sentence_id, sentence_count, status, completed_at)
+SELECT s.analyzer, MIN(q.id), MAX(q.id), COUNT(*), 'completed', NOW()
+FROM (
+  SELECT 'ginza' AS analyzer,
+         COALESCE((SELECT MIN(id) FROM public.sentence_queue WHERE ginza_status <> 'completed'), 9223372036854775807) AS first_pending
+  UNION ALL
+  SELECT 'stanza',
+         COALESCE((SELECT MIN(id) FROM public.sentence_queue WHERE stanza_status <> 'completed'), 9223372036854775807)
+) s
+JOIN public.sentence_queue q ON q.id < s.first_pending
+GROUP BY s.analyzer
+ON CONFLICT (analyzer, first_sentence_id) DO NOTHING;
+
+-- 3. 解析器ごとの状態列を削除
+ALTER TABLE public.sentence_queue DROP COLUMN IF EXISTS ginza_status;
+ALTER TABLE public.sentence_queue DROP COLUMN IF EXISTS stanza_status;
@@ -0,0 +1,20 @@
+-- =========== 候補語のスコアリング (score_terms.py) 用のテーブル ============
+
+-- 1. 出典URLごとの出現回数を記録する (process_common.save_discovered_words が累計する)
+ALTER TABLE public.word_occurrences
+  ADD COLUMN IF NOT EXISTS occurrence_count INTEGER NOT NULL DEFAULT 1,
+  ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT NOW() NOT NULL;
+
+-- 2. 語ごとのスコア (GiNZA/Stanzaの結果を表記でまとめたもの)
+CREATE TABLE IF NOT EXISTS public.term_scores (
+  word TEXT PRIMARY KEY,
+  document_frequency INTEGER NOT NULL,
+  total_count BIGINT NOT NULL,
+  tfidf DOUBLE PRECISION NOT NULL,
+  c_value DOUBLE PRECISION NOT NULL,
+  tool_count INTEGER NOT NULL,
+  tool_agreement DOUBLE PRECISION NOT NULL,
+  score DOUBLE PRECISION NOT NULL,
+  updated_at TIMESTAMPTZ DEFAULT NOW() NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_term_scores_score ON public.term_scores (score);
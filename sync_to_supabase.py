@@ -1,12 +1,17 @@
 import os
+import enum
+import datetime
 import configparser
+import metrics
 from db_utils import (
     get_local_db_session, 
     get_supabase_client, 
     CrawlQueue, 
     SentenceQueue, 
+    AnalysisBatch,
     UniqueWord, 
     WordOccurrence,
+    TermScore,
     ProcessStatusEnum # <-- 修正点: 正しい名前に変更
 )
 
@@ -26,7 +31,8 @@ def sync_table(local_session, supabase_client, model_class, table_name, columns,
     offset = 0
     while offset < total_rows:
         # 1. ローカルDBからバッチでデータを取得
-        local_records = local_session.query(model_class).offset(offset).limit(batch_size).all()
+        with metrics.timer("db.query_ms"):
+            local_records = local_session.query(model_class).offset(offset).limit(batch_size).all()
         
         # 2. Supabaseに投入するデータ形式 (dictのリスト) に変換
         data_to_upsert = []
@@ -34,9 +40,12 @@ def sync_table(local_session, supabase_client, model_class, table_name, columns,
             row_dict = {}
             for col in columns:
                 value = getattr(record, col)
-                # Enum型を文字列に変換
-                if isinstance(value, ProcessStatusEnum):
+                # Enum型を文字列に変換 (ProcessStatusEnumはSQLAlchemyの型なのでisinstanceには使えない)
+                if isinstance(value, enum.Enum):
                     row_dict[col] = str(value.name)
+                # 日時はJSONにそのまま載らないためISO 8601文字列にする
+                elif isinstance(value, (datetime.datetime, datetime.date)):
+                    row_dict[col] = value.isoformat()
                 else:
                     row_dict[col] = value
             data_to_upsert.append(row_dict)
@@ -44,9 +53,13 @@ def sync_table(local_session, supabase_client, model_class, table_name, columns,
         # 3. SupabaseへUpsert (存在すれば更新、なければ挿入)
         if data_to_upsert:
             try:
-                supabase_client.table(table_name).upsert(data_to_upsert).execute()
+                with metrics.timer("supabase.upsert_ms"):
+                    supabase_client.table(table_name).upsert(data_to_upsert).execute()
+                metrics.incr(f"sync.rows.{table_name}", len(data_to_upsert))
+                metrics.incr("sync.rows_written", len(data_to_upsert))
                 print(f"\r   [->] Synced {offset + len(local_records)} / {total_rows} rows...", end="")
             except Exception as e:
+                metrics.incr("sync.errors")
                 print(f"\n   [!] Error during upsert to {table_name}: {e}")
                 # エラーが発生しても処理を続行する場合もあるが、ここでは停止
                 return
@@ -61,6 +74,9 @@ def main():
     ローカルDBの全データをSupabaseに同期する
     """
     print("--- Sync to Supabase Started ---")
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    metrics.start("sync", config)
     local_session = get_local_db_session()
     supabase = get_supabase_client()
 
@@ -68,9 +84,11 @@ def main():
         # 同期対象のテーブルとカラムを定義
         tables_to_sync = {
             "crawl_queue": (CrawlQueue, ["id", "url", "extraction_status", "content_hash", "last_modified", "etag", "processed_at"]),
-            "sentence_queue": (SentenceQueue, ["id", "crawl_queue_id", "sentence_text", "ginza_status", "stanza_status"]),
+            "sentence_queue": (SentenceQueue, ["id", "crawl_queue_id", "sentence_text"]),
+            "analysis_batches": (AnalysisBatch, ["id", "analyzer", "first_sentence_id", "last_sentence_id", "sentence_count", "status", "claimed_at", "completed_at"]),
             "unique_words": (UniqueWord, ["id", "word", "source_tool", "entity_category", "pos_tag", "discovered_at"]),
-            "word_occurrences": (WordOccurrence, ["id", "word_id", "source_url"]),
+            "word_occurrences": (WordOccurrence, ["id", "word_id", "source_url", "occurrence_count", "updated_at"]),
+            "term_scores": (TermScore, ["word", "document_frequency", "total_count", "tfidf", "c_value", "tool_count", "tool_agreement", "score", "updated_at"]),
         }
 
         for table_name, (model, cols) in tables_to_sync.items():
@@ -80,6 +98,7 @@ def main():
         print(f"\n[!] A critical error occurred during sync process: {e}")
     finally:
         local_session.close()
+        metrics.finish()
 
     print("--- Sync to Supabase Finished ---")
 
@@ -0,0 +1,145 @@
+# warc_archive.py
+"""
+取得したレスポンスをgzip圧縮のWARCファイルに保存し、後から読み戻すためのユーティリティ。
+
+抽出ルールやセグメンタを変更したときに、mhlw.go.jpへ再アクセスせずに
+preprocessをやり直せるようにする (preprocess.py --replay)。
+warcioはこの機能を使う場合のみ必要。
+"""
+import os
+import sys
+import threading
+from datetime import datetime, timezone
+from http.client import responses as _HTTP_REASONS
+from io import BytesIO
+
+# 元のリクエストURL (crawl_queue.url)。リダイレクトで最終URLが変わった場合のみ付与する
+QUEUE_URL_HEADER = 'WARC-MTC-Queue-URL'
+# 本文はrequestsで展開済みのため、転送時の符号化を示すヘッダーは記録しない
+_DROPPED_HTTP_HEADERS = {'content-encoding', 'transfer-encoding', 'content-length'}
+
+
+def _require_warcio():
+    try:
+        import warcio  # noqa: F401
+    except ImportError:
+        raise RuntimeError("WARC capture/replay requires 'warcio'. Install it with: pip install warcio")
+
+
+class WarcRecorder:
+    """
+    FetchResultをWARCのresponseレコードとして追記する。スレッドセーフ。
+    プロセス間でファイルは共有しないこと (プロセスごとに別ファイルを開く)。
+    """
+    def __init__(self, path: str):
+        _require_warcio()
+        from warcio.warcwriter import WARCWriter
+        self.path = path
+        self._file = open(path, 'ab')
+        self._writer = WARCWriter(self._file, gzip=True)
+        self._lock = threading.Lock()
+        self.records_written = 0
+
+    def write_response(self, fetched, request_url: str = None):
+        from warcio.statusandheaders import StatusAndHeaders
+
+        reason = _HTTP_REASONS.get(fetched.status_code, '')
+        header_list = [(k, v) for k, v in fetched.headers.items() if k.lower() not in _DROPPED_HTTP_HEADERS]
+        header_list.append(('Content-Length', str(len(fetched.content))))
+        http_headers = StatusAndHeaders(f"{fetched.status_code} {reason}".strip(), header_list, protocol='HTTP/1.1')
+
+        warc_headers = {}
+        if request_url and request_url != fetched.url:
+            warc_headers[QUEUE_URL_HEADER] = request_url
+
+        with self._lock:
+            record = self._writer.create_warc_record(
+                fetched.url, 'response',
+                payload=BytesIO(fetched.content),
+                http_headers=http_headers,
+                warc_headers_dict=warc_headers,
+            )
+            self._writer.write_record(record)
+            # ワーカープロセスは明示的に終了処理されないため、レコードごとに書き出す
+            self._file.flush()
+            self.records_written += 1
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+def open_recorder(warc_dir: str, prefix: str):
+    """warc_dirが空ならNone。プロセスごとに一意なファイル名でWarcRecorderを開く"""
+    if not warc_dir:
+        return None
+    os.makedirs(warc_dir, exist_ok=True)
+    timestamp = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')
+    path = os.path.join(warc_dir, f"{prefix}-{timestamp}-{os.getpid()}.warc.gz")
+    return WarcRecorder(path)
+
+
+def list_warc_files(paths) -> list:
+    """ファイルまたはディレクトリの一覧から .warc / .warc.gz を列挙する"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(('.warc', '.warc.gz')):
+                    files.append(os.path.join(path, name))
+        elif os.path.exists(path):
+            files.append(path)
+        else:
+            print(f"   [!] WARC path not found: {path}", file=sys.stderr)
+    return files
+
+
+def _queue_url(record) -> str:
+    return record.rec_headers.get_header(QUEUE_URL_HEADER) or record.rec_headers.get_header('WARC-Target-URI')
+
+
+def latest_response_records(paths):
+    """
+    queue_urlごとにWARC-Dateが最も新しいresponseレコードを選ぶ。
+    同じURLは前処理とURL発見のアーカイブや、実行ごとのアーカイブに何度も現れるため、
+    どのレコードを再抽出に使うかをファイルの並び順に依存させない。
+    選んだレコードの (パス, ファイル内での順番) の集合と、除外した重複レコードの数を返す。
+    """
+    _require_warcio()
+    from warcio.archiveiterator import ArchiveIterator
+    from warcio.timeutils import iso_date_to_datetime
+
+    latest = {}
+    total = 0
+    for path in list_warc_files(paths):
+        with open(path, 'rb') as f:
+            for index, record in enumerate(ArchiveIterator(f)):
+                if record.rec_type != 'response' or record.http_headers is None:
+                    continue
+                total += 1
+                date = iso_date_to_datetime(record.rec_headers.get_header('WARC-Date'))
+                url = _queue_url(record)
+                # 日時が同じなら後に読んだレコードを使う
+                if url not in latest or date >= latest[url][0]:
+                    latest[url] = (date, (path, index))
+    return {position for _, position in latest.values()}, total - len(latest)
+
+
+def iter_warc_responses(paths, only=None):
+    """
+    WARC中のresponseレコードを (queue_url, content, content_type) で順に返す。
+    onlyに (パス, ファイル内での順番) の集合を渡すと、そのレコードだけを返す (latest_response_records() を参照)。
+    """
+    _require_warcio()
+    from warcio.archiveiterator import ArchiveIterator
+
+    for path in list_warc_files(paths):
+        with open(path, 'rb') as f:
+            for index, record in enumerate(ArchiveIterator(f)):
+                if record.rec_type != 'response' or record.http_headers is None:
+                    continue
+                if only is not None and (path, index) not in only:
+                    continue
+                content_type = record.http_headers.get_header('Content-Type', '').lower()
+                yield _queue_url(record), record.content_stream().read(), content_type